@@ -1,25 +1,56 @@
-from flask import Flask, render_template, request, Response, stream_with_context, send_file, jsonify
-import google.generativeai as genai
+# Optional cooperative I/O (pip install gevent, then USE_GEVENT=1): the stdlib must be patched before
+# anything below imports sockets or threads, so each streaming /chat holds a greenlet instead of an OS thread
 import os
-import re
-import io
+if os.getenv("USE_GEVENT") == "1":
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, render_template, request, Response, stream_with_context, send_file, jsonify, make_response
+import google.generativeai as genai
+import stat
+import mmap
+import tempfile
 import img2pdf
 import pytesseract # Added for OCR
-from PyPDF2 import PdfMerger # Added for merging PDFs
+import pikepdf # QPDF-backed, for merging PDFs
 from PIL import Image # For image validation
 from io import BytesIO # For handling byte streams
 import sqlite3
+import atexit
+import queue
 import json
+try:
+    import orjson # Optional: faster JSON for SSE events
+except ImportError:
+    orjson = None
+from json.encoder import encode_basestring_ascii as encode_json_string # C-accelerated JSON string escaping
+import hashlib
+import zlib
+import gzip
+import time
+import threading
+import functools
+import bisect
+import secrets
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests # For fetching URL content
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup # For parsing HTML
-import html  # Add this import at the top with other imports
+import lxml.html # Fast C parser for extracting text from HTML
+import charset_normalizer # Encoding detection for fetched pages (installed with requests)
+from markupsafe import escape as escape_html # C-accelerated, several times faster than html.escape
 
 # Load API Key
 load_dotenv()
 API_KEY = os.getenv("GOOGLE_API_KEY")
 FETCHED_MODELS = [] # Global list to store fetched models
+FETCHED_MODELS_SET = frozenset() # Same models, for O(1) validation of requests
+MODEL_REFRESH_TTL = 600 # Seconds before the model list is refreshed (in the background)
 
 # --- Configuration ---
 DEFAULT_MODEL_NAME = "gemini-2.5-pro-exp-03-25" # Fallback default
@@ -32,9 +63,31 @@ FREE_TIER_LIMITS = {
     # Add entries for other models as needed, key should match the API model name (e.g., "models/...")
 }
 
+# --- Context Caching ---
+MAX_PROMPT_TOKENS = 900_000 # Reject prompts estimated above this before calling Gemini (~1M token window)
+# Gemini rejects explicit caches below a minimum size, so smaller contexts are sent inline.
+MIN_CACHE_TOKENS = 4096
+CONTEXT_CACHE_TTL = timedelta(minutes=10)
+CONTEXT_CACHE_MAX_ENTRIES = 32
+CONTEXT_CACHE = OrderedDict() # sha256(model + context) -> (CachedContent, local expiry), LRU order
+CONTEXT_CACHE_LOCK = threading.Lock()
+RESPONSE_CACHE_MAX_ENTRIES = 128
+RESPONSE_CACHE = OrderedDict() # sha256(model + final prompt) -> full bot response, LRU order (opt-in via ?cache=1)
+RESPONSE_CACHE_LOCK = threading.Lock()
+CHAT_SESSION_TTL = timedelta(hours=1) # Idle chat sessions are dropped after this
+CHAT_SESSION_MAX_HISTORY = 20 # Messages (user + model) carried between turns
+CHAT_SESSIONS = {} # 'sid' cookie -> {'chat': ChatSession, 'model_key': ..., 'last_used': datetime}
+CHAT_SESSIONS_LOCK = threading.Lock()
+CHAT_SESSIONS_BUSY = set() # sids with a turn in flight; a second message for one is rejected until it finishes
+
 MAX_FILE_SIZE_MB = 10  # Limit file size
 MAX_FILE_READ_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+FILE_CONTEXT_TEMPLATE = "--- START CONTEXT FROM FILE: %s ---\n%s\n--- END CONTEXT FROM FILE: %s ---\n\n"
+PDF_SPOOL_MAX_BYTES = 4 * 1024 * 1024 # Generated PDFs above this are spooled to a temp file
+MMAP_MIN_FILE_BYTES = 64 * 1024 # Smaller files are read normally; mmap setup isn't worth it
 DB_NAME = 'chat_history.db'
+HISTORY_PAGE_SIZE = 200 # Messages rendered per page on '/'
+MAX_HISTORY_PAGE_SIZE = 1000 # Upper bound for the ?limit= of /fetch_history
 
 # --- Flask App Setup ---
 app = Flask(__name__)
@@ -52,16 +105,136 @@ def init_db():
             context_info TEXT NULL
         )
     ''')
+    # Day of each message ('YYYY-MM-DD') for the date dropdown, derived by SQLite; ALTER TABLE can only
+    # add VIRTUAL generated columns, which still index normally
+    cursor.execute("PRAGMA table_xinfo(history)")
+    if 'date_only' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE history ADD COLUMN date_only TEXT GENERATED ALWAYS AS (substr(timestamp, 1, 10)) VIRTUAL")
+    # Same indexes as database.init_db, which runs against this file too; keep the two in sync.
+    # Lets the paginated history queries walk rows newest-first without sorting the whole table
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_ts ON history(timestamp DESC)")
+    # Date dropdown (per-day filters use a timestamp range instead)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_date_only ON history(date_only)")
+    # Superseded: the DATE(timestamp) expression index and an ascending duplicate of idx_history_ts
+    cursor.execute("DROP INDEX IF EXISTS idx_history_date")
+    cursor.execute("DROP INDEX IF EXISTS idx_history_timestamp")
     conn.commit()
     conn.close()
 
 init_db() # Initialize DB on startup
 
-def get_db():
-    conn = sqlite3.connect(DB_NAME)
+# One long-lived connection per worker thread, so requests skip the open/journal setup cost
+DB_POOL_SIZE = 8 # Long-lived connections shared by request threads
+
+def open_db_connection():
+    """Opens a SQLite connection to DB_NAME tuned for long-lived, cross-thread use."""
+    # Autocommit mode: each statement commits on its own unless a transaction is opened explicitly
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row # Return rows as dict-like objects
+    conn.executescript(
+        "PRAGMA journal_mode=WAL;"     # Readers don't block the writer and vice versa
+        "PRAGMA synchronous=NORMAL;"   # Safe with WAL, avoids an fsync per commit
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA cache_size=-64000;"    # ~64 MB page cache, kept warm across requests
+        "PRAGMA mmap_size=268435456;"  # Read pages straight from a 256 MB memory map, skipping a copy per read
+    )
     return conn
 
+# LIFO so the most recently used (warmest) connection is handed out first
+_db_pool = queue.LifoQueue()
+for _ in range(DB_POOL_SIZE):
+    _db_pool.put(open_db_connection())
+
+@contextmanager
+def get_db():
+    """Borrows a pooled SQLite connection for the duration of a with block."""
+    conn = _db_pool.get() # Waits if every connection is in use
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction: # Never hand the next borrower a half-finished transaction
+            conn.execute("ROLLBACK")
+        _db_pool.put(conn)
+
+def close_db():
+    """Closes the idle pooled connections."""
+    while True:
+        try:
+            _db_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+atexit.register(close_db)
+
+# --- Streaming ---
+# Fixed SSE framing for text chunks, the hot path of every chat response; other events go through sse_event()
+SSE_TEXT_PREFIX = b'data: {"text": '
+SSE_TEXT_SUFFIX = b'}\n\n'
+
+def sse_event(payload):
+    """Frames a JSON-serializable payload as one SSE 'data:' event, as bytes."""
+    if orjson is not None:
+        return b"data: " + orjson.dumps(payload) + b"\n\n"
+    return b"data: " + json.dumps(payload).encode('ascii') + b"\n\n"
+
+# --- Background History Writer ---
+# Chat interactions are saved off the streaming path so the final SSE event isn't held up by disk I/O
+HISTORY_WRITE_BATCH_SIZE = 64
+HISTORY_WRITE_DEBOUNCE_SECONDS = 0.05 # How long to wait for more rows to share a commit
+INSERT_HISTORY_SQL = "INSERT INTO history (user_message, bot_response, context_info) VALUES (?, ?, ?)" # Constant text keeps sqlite3's statement cache warm
+_history_write_queue = queue.Queue() # (user_message, bot_response, context_info_json) tuples
+
+def _history_writer_loop():
+    """Drains queued chat interactions and saves them, one transaction per batch."""
+    conn = None # The single writer keeps its own connection, outside the reader pool; (re)opened on demand
+    while True:
+        rows = [_history_write_queue.get()] # Block until there's something to write
+        try:
+            # Give a burst of saves a short window to join this batch, so they share one commit
+            deadline = time.monotonic() + HISTORY_WRITE_DEBOUNCE_SECONDS
+            while len(rows) < HISTORY_WRITE_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(_history_write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if conn is None:
+                conn = open_db_connection()
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(INSERT_HISTORY_SQL, rows)
+            conn.execute("COMMIT")
+            for user_message, bot_response, _ in rows:
+                print(f"Saved interaction: User: '{user_message[:50]}...', Bot: '{bot_response[:50]}...'")
+        except Exception as e:
+            # Any failure only loses this batch; the thread has to survive or later saves (and shutdown) hang
+            print(f"Database error saving {len(rows)} chat interaction(s): {e}")
+            if conn is not None:
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except Exception as rollback_error:
+                    print(f"Rollback failed, reopening the history writer connection: {rollback_error}")
+                    conn = None # The next batch starts on a fresh connection
+        finally:
+            for _ in rows:
+                _history_write_queue.task_done()
+
+threading.Thread(target=_history_writer_loop, name="history-writer", daemon=True).start()
+# Flush pending writes on shutdown (registered after close_db, so it runs first)
+atexit.register(_history_write_queue.join)
+
+# --- Outbound HTTP ---
+# One shared session so the model list and URL context fetches reuse pooled keep-alive connections
+# instead of paying a new TCP/TLS handshake per request
+HTTP_SESSION = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20,
+                            max_retries=Retry(total=2, backoff_factor=0.3, allowed_methods=frozenset(['GET'])))
+HTTP_SESSION.mount('https://', _http_adapter)
+HTTP_SESSION.mount('http://', _http_adapter)
+
 def get_available_models(api_key):
     """Fetches available models from the Google Generative Language API."""
     if not api_key:
@@ -71,7 +244,7 @@ def get_available_models(api_key):
     models_list = []
     try:
         url = f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}"
-        response = requests.get(url, timeout=10)
+        response = HTTP_SESSION.get(url, timeout=10)
         response.raise_for_status() # Raise HTTPError for bad responses
         data = response.json()
 
@@ -112,6 +285,31 @@ else:
     except Exception as e:
         print(f"Error configuring Gemini API: {e}")
         FETCHED_MODELS = [DEFAULT_MODEL_NAME] # Fallback on config error
+FETCHED_MODELS_SET = frozenset(FETCHED_MODELS)
+_models_refreshed_at = time.monotonic()
+_models_refresh_lock = threading.Lock() # Held while a background refresh is running
+
+def _refresh_models():
+    """Fetches the model list and swaps in the new list and set."""
+    global FETCHED_MODELS, FETCHED_MODELS_SET
+    try:
+        models = get_available_models(API_KEY)
+        if DEFAULT_MODEL_NAME not in models:
+            models.insert(0, DEFAULT_MODEL_NAME)
+        FETCHED_MODELS = models
+        FETCHED_MODELS_SET = frozenset(models)
+    finally:
+        _models_refresh_lock.release()
+
+def refresh_models_if_stale():
+    """Starts a background refresh of the model list once MODEL_REFRESH_TTL has passed; never blocks."""
+    global _models_refreshed_at
+    if not API_KEY or time.monotonic() - _models_refreshed_at < MODEL_REFRESH_TTL:
+        return
+    if not _models_refresh_lock.acquire(blocking=False):
+        return # A refresh is already running
+    _models_refreshed_at = time.monotonic()
+    threading.Thread(target=_refresh_models, name="model-refresh", daemon=True).start()
 
 # (Keep process_context_path and parse_input_for_context functions as they are
 #  in GeminiChatBot.py, just paste them here without the main() or load_api_key())
@@ -130,62 +328,117 @@ if not os.path.exists(ALLOWED_CONTEXT_DIR):
         # Depending on the desired behavior, you might want to exit or handle this differently
         ALLOWED_CONTEXT_DIR = None # Indicate failure
 
+# Resolved once so containment checks don't re-walk the allowed dir's own path components
+ALLOWED_CONTEXT_REAL = os.path.realpath(ALLOWED_CONTEXT_DIR) if ALLOWED_CONTEXT_DIR else None
+ALLOWED_CONTEXT_PREFIX = ALLOWED_CONTEXT_DIR + os.sep if ALLOWED_CONTEXT_DIR else None
+ALLOWED_CONTEXT_REAL_PREFIX = os.path.join(ALLOWED_CONTEXT_REAL, '') if ALLOWED_CONTEXT_REAL else None # Ends with a separator
+
+# Separator-bounded '..' forms, so traversal checks don't split the path into a list
+PARENT_DIR_PREFIX = '..' + os.sep
+PARENT_DIR_SUFFIX = os.sep + '..'
+PARENT_DIR_INFIX = os.sep + '..' + os.sep
+
+def has_parent_dir_component(path):
+    """Same result as '..' in path.split(os.sep)."""
+    return (path == '..' or path.startswith(PARENT_DIR_PREFIX)
+            or path.endswith(PARENT_DIR_SUFFIX) or PARENT_DIR_INFIX in path)
+
+def is_within_allowed_dir(real_path):
+    """Checks that an already-resolved path is ALLOWED_CONTEXT_REAL or lies inside it."""
+    # Both sides are realpath() output, so a plain prefix test on the separator-terminated
+    # directory is exact ('allowed_context_evil' doesn't match 'allowed_context/')
+    return real_path == ALLOWED_CONTEXT_REAL or real_path.startswith(ALLOWED_CONTEXT_REAL_PREFIX)
+
 # --- URL Fetching and Processing ---
 MAX_URL_CONTENT_BYTES = 2 * 1024 * 1024 # Limit URL content size (e.g., 2MB)
+MAX_URL_FETCH_WORKERS = 16 # Concurrent URL fetches per summary request
 REQUEST_TIMEOUT = 10 # Seconds
+URL_READ_CHUNK_BYTES = 64 * 1024
+
+def decode_url_content(content, response):
+    """
+    Decodes fetched URL bytes: the charset declared in the Content-Type header if any,
+    else UTF-8, else the encoding charset_normalizer detects (e.g. windows-1252 pages).
+    """
+    if 'charset=' in response.headers.get('content-type', '').lower() and response.encoding:
+        try:
+            return content.decode(response.encoding, errors='replace')
+        except LookupError: # Unknown charset name in the header
+            pass
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        best = charset_normalizer.from_bytes(content).best()
+        return str(best) if best is not None else content.decode('utf-8', errors='ignore')
+
+def extract_html_text(html_content):
+    """
+    Returns the visible text of an HTML document: script and style contents removed,
+    each text node stripped and joined with single spaces.
+    Parses with lxml (C parser), falling back to BeautifulSoup if lxml can't handle the input.
+    """
+    try:
+        doc = lxml.html.document_fromstring(html_content)
+        for script_or_style in doc.xpath('//script|//style'):
+            script_or_style.drop_tree() # Keeps the tail text that follows the element
+        return ' '.join(s for s in (t.strip() for t in doc.itertext()) if s)
+    except Exception as e:
+        print(f"lxml could not parse HTML ({e}), falling back to BeautifulSoup.")
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Remove script and style elements
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    # Get text, strip leading/trailing whitespace, join lines
+    return ' '.join(soup.stripped_strings)
 
 def fetch_and_process_url(url):
     """Fetches content from a URL, extracts text, and handles errors."""
     context_str = ""
     error_msg = None
     processed_url_info = {"original": url, "status": "error", "message": None}
+    response = None
 
     try:
         headers = { # Mimic a browser to avoid simple blocks
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+        response = HTTP_SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
 
         content_type = response.headers.get('content-type', '').lower()
+        content_length = response.headers.get('content-length', '')
 
-        # Basic check for HTML/Text content
-        if 'html' in content_type or 'text' in content_type:
-            content = b""
-            bytes_read = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                content += chunk
-                bytes_read += len(chunk)
-                if bytes_read > MAX_URL_CONTENT_BYTES:
+        if content_length.isdigit() and int(content_length) > MAX_URL_CONTENT_BYTES:
+            # Declared too large: reject before pulling any of the body over the network
+            error_msg = (f"Error: URL content too large ({int(content_length) / (1024*1024):.1f} MB > "
+                         f"{MAX_URL_CONTENT_BYTES / (1024*1024):.1f} MB limit): {url}")
+            processed_url_info["message"] = error_msg
+        elif 'html' in content_type or 'text' in content_type: # Basic check for HTML/Text content
+            content = bytearray() # Grows in place; bytes += chunk would copy the whole buffer every chunk
+            for chunk in response.iter_content(chunk_size=URL_READ_CHUNK_BYTES):
+                content.extend(chunk)
+                if len(content) > MAX_URL_CONTENT_BYTES:
+                    del content[MAX_URL_CONTENT_BYTES:] # Keep exactly the limit
                     error_msg = f"Error: URL content exceeds limit ({MAX_URL_CONTENT_BYTES / (1024*1024):.1f} MB). Truncated."
                     processed_url_info["message"] = error_msg
                     break # Stop reading
 
-            # Decode content (attempt common encodings)
-            try:
-                decoded_content = content.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    decoded_content = content.decode('iso-8859-1')
-                except UnicodeDecodeError:
-                    decoded_content = content.decode('ascii', errors='ignore') # Fallback
+            decoded_content = decode_url_content(content, response)
 
-            # Extract text using BeautifulSoup for HTML
+            # Extract text from HTML
             if 'html' in content_type:
-                soup = BeautifulSoup(decoded_content, 'html.parser')
-                # Remove script and style elements
-                for script_or_style in soup(["script", "style"]):
-                    script_or_style.decompose()
-                # Get text, strip leading/trailing whitespace, join lines
-                text = ' '.join(soup.stripped_strings)
+                text = extract_html_text(decoded_content)
             else: # Plain text
                 text = decoded_content
 
-            context_str += f"--- START CONTEXT FROM URL: {url} ---\n"
-            context_str += text[:MAX_URL_CONTENT_BYTES] # Ensure final text doesn't exceed limit again
+            parts = [
+                f"--- START CONTEXT FROM URL: {url} ---\n",
+                text[:MAX_URL_CONTENT_BYTES] # Ensure final text doesn't exceed limit again
+            ]
             if error_msg: # Append truncation warning if it occurred
-                 context_str += "\n... (Content Truncated)"
-            context_str += f"\n--- END CONTEXT FROM URL: {url} ---\n\n"
+                 parts.append("\n... (Content Truncated)")
+            parts.append(f"\n--- END CONTEXT FROM URL: {url} ---\n\n")
+            context_str = "".join(parts)
             processed_url_info["status"] = "ok"
             processed_url_info["context_added"] = True
             if error_msg: # Keep the truncation message
@@ -204,6 +457,9 @@ def fetch_and_process_url(url):
     except Exception as e:
         error_msg = f"Error processing URL {url}: {e}"
         processed_url_info["message"] = error_msg
+    finally:
+        if response is not None:
+            response.close() # Hand the connection back to the pool even if the body wasn't fully read
 
     return context_str, error_msg, processed_url_info
 
@@ -213,22 +469,22 @@ def process_context_path(path):
     Reads content from a file or lists contents of a folder within the ALLOWED_CONTEXT_DIR.
     Returns a formatted string with the context or an error message.
     """
-    context_str = ""
+    parts = [] # Context pieces, joined once at the end
     error_msg = None
     processed_path_info = {"original": path, "resolved": None, "status": "error", "message": None}
 
     if not ALLOWED_CONTEXT_DIR:
         error_msg = "Error: The allowed context directory is not configured or accessible."
         processed_path_info["message"] = error_msg
-        return context_str, error_msg, processed_path_info
+        return "", error_msg, processed_path_info
 
     clean_path = path.strip().strip("'\"") # Remove surrounding quotes and whitespace
 
     # Prevent absolute paths and path traversal attempts
-    if os.path.isabs(clean_path) or ".." in clean_path.split(os.path.sep):
+    if os.path.isabs(clean_path) or has_parent_dir_component(clean_path):
          error_msg = f"Error: Only relative paths within '{ALLOWED_CONTEXT_DIR_NAME}' are allowed. Path traversal ('..') or absolute paths are forbidden: '{path}'"
          processed_path_info["message"] = error_msg
-         return context_str, error_msg, processed_path_info
+         return "", error_msg, processed_path_info
 
     # Construct the full path securely within the allowed directory
     # os.path.join handles path separators correctly
@@ -238,79 +494,92 @@ def process_context_path(path):
     processed_path_info["resolved"] = target_path # Store the actual path we are checking
 
     # Security Check: Ensure the resolved path is still within the allowed directory
-    if not target_path.startswith(ALLOWED_CONTEXT_DIR + os.path.sep) and target_path != ALLOWED_CONTEXT_DIR:
+    if not is_within_allowed_dir(target_path):
         error_msg = f"Error: Access denied. Path '{path}' resolves outside the allowed directory '{ALLOWED_CONTEXT_DIR_NAME}'."
         processed_path_info["message"] = error_msg
-        return context_str, error_msg, processed_path_info
+        return "", error_msg, processed_path_info
 
-    if not os.path.exists(target_path):
+    # One stat() answers existence, type and size together
+    try:
+        target_stat = os.stat(target_path)
+    except OSError: # Not found (or not accessible), same as os.path.exists() returning False
+        target_stat = None
+    if target_stat is None:
         error_msg = f"Error: Path not found within '{ALLOWED_CONTEXT_DIR_NAME}': '{clean_path}' (resolved to '{target_path}')"
         processed_path_info["message"] = error_msg
-        return context_str, error_msg, processed_path_info
+        return "", error_msg, processed_path_info
 
     try:
-        relative_display_path = os.path.relpath(target_path, ALLOWED_CONTEXT_DIR) # Path relative to allowed dir for display
+        relative_display_path = os.path.relpath(target_path, ALLOWED_CONTEXT_REAL) # Path relative to allowed dir for display
 
-        if os.path.isfile(target_path):
-            file_size = os.path.getsize(target_path)
+        if stat.S_ISREG(target_stat.st_mode):
+            file_size = target_stat.st_size
             if file_size > MAX_FILE_READ_BYTES:
                  error_msg = (f"Error: File '{relative_display_path}' is too large "
                               f"({file_size / (1024*1024):.2f} MB > "
                               f"{MAX_FILE_SIZE_MB} MB limit). Skipping.")
                  processed_path_info["message"] = error_msg
-                 return context_str, error_msg, processed_path_info
+                 return "", error_msg, processed_path_info
 
-            context_str += f"--- START CONTEXT FROM FILE: {relative_display_path} ---\n"
             try:
-                with open(target_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    context_str += f.read()
+                if file_size >= MMAP_MIN_FILE_BYTES:
+                    # Decode straight from the page cache instead of copying the file into a read buffer first
+                    with open(target_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        content = str(mm, 'utf-8', 'ignore')
+                else:
+                    # Small files are the common case: one capped binary read, decoded once
+                    # (the cap also covers a file that grew since it was stat'ed)
+                    with open(target_path, 'rb') as f:
+                        content = f.read(MAX_FILE_READ_BYTES).decode('utf-8', 'ignore')
             except Exception as e:
                  error_msg = f"Error reading file '{relative_display_path}': {e}"
                  processed_path_info["message"] = error_msg
                  return "", error_msg, processed_path_info # Return empty context on read error
-            context_str += f"\n--- END CONTEXT FROM FILE: {relative_display_path} ---\n\n"
             processed_path_info["status"] = "ok"
             processed_path_info["context_added"] = True
+            # A single file needs no parts list: format header, content and footer in one go
+            return FILE_CONTEXT_TEMPLATE % (relative_display_path, content, relative_display_path), None, processed_path_info
 
-        elif os.path.isdir(target_path):
-            context_str += f"--- START CONTEXT FROM FOLDER CONTENTS: {relative_display_path}/ ---\n"
+        elif stat.S_ISDIR(target_stat.st_mode):
+            parts.append(f"--- START CONTEXT FROM FOLDER CONTENTS: {relative_display_path}/ ---\n")
             try:
-                items = os.listdir(target_path)
+                # scandir entries carry the file type from the directory read and cache their stat()
+                with os.scandir(target_path) as it:
+                    entries = sorted(it, key=lambda e: e.name) # List items predictably
                 folder_had_items = False
-                if not items:
-                    context_str += "(Folder is empty)\n"
+                if not entries:
+                    parts.append("(Folder is empty)\n")
                 else:
                     folder_had_items = True
                     # Limit the number of files listed for performance/context size
                     MAX_FILES_IN_DIR = 50
                     count = 0
-                    items.sort() # List items predictably
-                    for item in items:
+                    for entry in entries:
                         if count >= MAX_FILES_IN_DIR:
-                            context_str += f"... (truncated listing at {MAX_FILES_IN_DIR} items)\n"
+                            parts.append(f"... (truncated listing at {MAX_FILES_IN_DIR} items)\n")
                             break
 
-                        item_full_path = os.path.join(target_path, item)
-                        # Ensure items listed are also within the allowed dir (redundant but safe)
-                        if not os.path.realpath(item_full_path).startswith(ALLOWED_CONTEXT_DIR + os.path.sep):
-                            context_str += f"--- SKIPPING ITEM (outside allowed dir): {item} ---\n"
+                        item = entry.name
+                        # target_path is already resolved, so only a symlink can lead outside the allowed dir
+                        if entry.is_symlink() and not is_within_allowed_dir(os.path.realpath(entry.path)):
+                            parts.append(f"--- SKIPPING ITEM (outside allowed dir): {item} ---\n")
                             continue
 
                         item_rel_path = os.path.join(relative_display_path, item)
 
-                        if os.path.isfile(item_full_path):
+                        if entry.is_file():
                             try:
-                                file_size = os.path.getsize(item_full_path)
+                                file_size = entry.stat().st_size
                                 if file_size > MAX_FILE_READ_BYTES:
-                                    context_str += f"--- SKIPPING FILE (too large): {item_rel_path} ({file_size / (1024*1024):.2f} MB > {MAX_FILE_SIZE_MB} MB) ---\n"
+                                    parts.append(f"--- SKIPPING FILE (too large): {item_rel_path} ({file_size / (1024*1024):.2f} MB > {MAX_FILE_SIZE_MB} MB) ---\n")
                                 else:
                                     # List file name and size
-                                    context_str += f"- {item_rel_path} ({file_size / 1024:.1f} KB)\n"
+                                    parts.append(f"- {item_rel_path} ({file_size / 1024:.1f} KB)\n")
                                     count += 1
                             except Exception as e:
-                                context_str += f"--- ERROR ACCESSING FILE: {item_rel_path} ({e}) ---\n"
-                        elif os.path.isdir(item_full_path):
-                            context_str += f"- {item_rel_path}/ [DIR]\n"
+                                parts.append(f"--- ERROR ACCESSING FILE: {item_rel_path} ({e}) ---\n")
+                        elif entry.is_dir():
+                            parts.append(f"- {item_rel_path}/ [DIR]\n")
                             count += 1
                         # else: ignore other types like symlinks etc.
 
@@ -318,12 +587,12 @@ def process_context_path(path):
                  error_msg = f"Error processing directory '{relative_display_path}': {e}"
                  processed_path_info["message"] = error_msg
                  return "", error_msg, processed_path_info # Return empty context on error
-            context_str += f"--- END CONTEXT FROM FOLDER CONTENTS: {relative_display_path}/ ---\n\n"
+            parts.append(f"--- END CONTEXT FROM FOLDER CONTENTS: {relative_display_path}/ ---\n\n")
             processed_path_info["status"] = "ok"
             processed_path_info["context_added"] = folder_had_items # Context added if folder wasn't empty
 
         else:
-            # This case should technically not be reached due to os.path.exists check earlier
+            # e.g. a FIFO, socket or device node
             error_msg = f"Error: Path '{relative_display_path}' exists but is not a file or directory."
             processed_path_info["message"] = error_msg
 
@@ -333,6 +602,8 @@ def process_context_path(path):
         processed_path_info["message"] = error_msg
 
 
+    context_str = "".join(parts)
+
     # If context_str is empty but no error occurred (e.g., empty file/dir), set status ok
     if not error_msg and not context_str and processed_path_info["status"] != "ok":
          processed_path_info["status"] = "ok"
@@ -343,52 +614,72 @@ def process_context_path(path):
     return context_str, error_msg, processed_path_info
 
 
+def scan_context_paths(text):
+    """
+    Finds @ {path} references in a single left-to-right pass.
+    A path is double-quoted, single-quoted, or a bare run of non-whitespace;
+    an empty or unclosed quote is taken as part of a bare path.
+    Returns a list of (start, end, path) tuples, where start/end span the whole reference.
+    """
+    found = []
+    n = len(text)
+    i = text.find('@')
+    while i != -1:
+        j = i + 1
+        while j < n and text[j].isspace(): # Skip whitespace between '@' and the path
+            j += 1
+        if j == n:
+            break
+        end = -1
+        if text[j] in '"\'':
+            close = text.find(text[j], j + 1)
+            if close > j + 1: # Non-empty quoted path
+                found.append((i, close + 1, text[j + 1:close]))
+                end = close + 1
+        if end == -1: # Bare path: text[j] is known to be non-whitespace
+            end = j + 1
+            while end < n and not text[end].isspace():
+                end += 1
+            found.append((i, end, text[j:end]))
+        i = text.find('@', end)
+    return found
+
 def parse_input_for_context(user_input):
     """
     Finds @ {path} patterns, processes them using process_context_path,
     and returns the context string, the cleaned user message, errors,
     and detailed info about processed paths.
     """
-    path_pattern = r'@\s*(?:"([^"]+)"|\'([^\']+)\'|(\S+))' # Same pattern
-    matches = list(re.finditer(path_pattern, user_input))
-
-    if not matches:
+    if '@' not in user_input:
         return "", user_input, [], [] # No context found, return empty lists for errors/paths
 
-    full_context = ""
+    context_parts = [] # Successful context pieces, joined once below
     errors = []
     processed_paths_details = [] # Store detailed info from process_context_path
-    processed_indices = set()
-
-    for match in reversed(matches): # Process from end to start for easier index removal
-        start, end = match.span()
-        # Skip if this match overlaps with an already processed one (e.g., @ "path1 @ path2")
-        if any(i in processed_indices for i in range(start, end)):
-            continue
+    message_pieces = [] # Text between the @{path} patterns, in order
+    last_end = 0
 
-        # Extract path (quoted or unquoted)
-        path = match.group(1) or match.group(2) or match.group(3)
-        if path:
-            # Call the updated context processing function
-            context_part, error, path_info = process_context_path(path)
+    for start, end, path in scan_context_paths(user_input): # References never overlap, so process them in order
+        message_pieces.append(user_input[last_end:start])
+        last_end = end
 
-            # Store the detailed path processing info
-            processed_paths_details.append(path_info)
+        # Call the updated context processing function
+        context_part, error, path_info = process_context_path(path)
 
-            if error:
-                # Add the specific error message from path processing
-                errors.append(error)
-            elif context_part:
-                 # Prepend context only if successfully retrieved
-                 full_context = context_part + full_context
+        # Store the detailed path processing info
+        processed_paths_details.append(path_info)
 
-            # Mark indices of the @{path} pattern as processed
-            for i in range(start, end):
-                processed_indices.add(i)
+        if error:
+            # Add the specific error message from path processing
+            errors.append(error)
+        elif context_part:
+             # Add context only if successfully retrieved
+             context_parts.append(context_part)
 
-    # Build the cleaned message by excluding processed indices
-    cleaned_message_list = [char for i, char in enumerate(user_input) if i not in processed_indices]
-    cleaned_message = "".join(cleaned_message_list).strip()
+    full_context = "".join(context_parts)
+    # Build the cleaned message from the slices around the @{path} patterns
+    message_pieces.append(user_input[last_end:])
+    cleaned_message = "".join(message_pieces).strip()
 
     if not cleaned_message and full_context:
         cleaned_message = "(Referring to provided context)"
@@ -400,58 +691,248 @@ def parse_input_for_context(user_input):
     return full_context, cleaned_message, errors, processed_paths_details
 
 
+# --- Gemini Context Caching ---
+def get_cached_context_model(model_name, context_str):
+    """
+    Returns a GenerativeModel whose prefix is an explicit Gemini cache of context_str,
+    creating the cache on first use and reusing it while its TTL lasts.
+    Returns None when the context is too small to cache or caching fails,
+    in which case the caller should send the context inline.
+    """
+    if len(context_str) // 4 < MIN_CACHE_TOKENS: # Rough estimate: ~4 characters per token
+        return None
+
+    key = hashlib.sha256(f"{model_name}\0{context_str}".encode('utf-8')).hexdigest()
+    now = datetime.now()
+    with CONTEXT_CACHE_LOCK:
+        entry = CONTEXT_CACHE.get(key)
+        if entry and entry[1] > now:
+            CONTEXT_CACHE.move_to_end(key)
+            cache = entry[0]
+        else:
+            cache = None
+
+    if cache is None:
+        try:
+            cache = genai.caching.CachedContent.create(
+                model=model_name,
+                contents=[context_str],
+                ttl=CONTEXT_CACHE_TTL
+            )
+        except Exception as e:
+            print(f"Context caching unavailable for model '{model_name}': {e}. Sending context inline.")
+            return None
+        print(f"Created context cache {cache.name} for model: {model_name}")
+        with CONTEXT_CACHE_LOCK:
+            # Expire locally a little early so we never reference a cache the server just dropped
+            CONTEXT_CACHE[key] = (cache, now + CONTEXT_CACHE_TTL - timedelta(seconds=30))
+            CONTEXT_CACHE.move_to_end(key)
+            while len(CONTEXT_CACHE) > CONTEXT_CACHE_MAX_ENTRIES:
+                CONTEXT_CACHE.popitem(last=False)
+
+    return genai.GenerativeModel.from_cached_content(cached_content=cache)
+
+
+# --- Chat Sessions ---
+@functools.lru_cache(maxsize=16)
+def get_generative_model(model_name):
+    """Returns a GenerativeModel for model_name, built once per process."""
+    return genai.GenerativeModel(model_name)
+
+def get_chat_session(sid, model_key, model):
+    """
+    Returns the ChatSession for a browser session so turns build on a stable history prefix.
+    A new session is started on model when none exists or model_key (model + cached context)
+    changed, carrying over the trimmed history. Sessions idle past CHAT_SESSION_TTL are dropped.
+    """
+    now = datetime.now()
+    with CHAT_SESSIONS_LOCK:
+        for stale_sid in [s for s, e in CHAT_SESSIONS.items() if now - e['last_used'] > CHAT_SESSION_TTL]:
+            del CHAT_SESSIONS[stale_sid]
+        entry = CHAT_SESSIONS.get(sid)
+
+    history = entry['chat'].history[-CHAT_SESSION_MAX_HISTORY:] if entry else []
+    if entry and entry['model_key'] == model_key:
+        chat = entry['chat']
+        chat.history = history
+    else:
+        chat = model.start_chat(history=history)
+
+    with CHAT_SESSIONS_LOCK:
+        CHAT_SESSIONS[sid] = {'chat': chat, 'model_key': model_key, 'last_used': now}
+    return chat
+
+def acquire_chat_session(sid):
+    """Marks sid as answering a message. Returns False if a turn for it is already in flight."""
+    with CHAT_SESSIONS_LOCK:
+        if sid in CHAT_SESSIONS_BUSY:
+            return False
+        CHAT_SESSIONS_BUSY.add(sid)
+        return True
+
+def release_chat_session(sid):
+    """Ends the turn started by acquire_chat_session."""
+    with CHAT_SESSIONS_LOCK:
+        CHAT_SESSIONS_BUSY.discard(sid)
+
+def chat_session_has_history(sid):
+    """True if sid's chat session already holds earlier turns."""
+    with CHAT_SESSIONS_LOCK:
+        entry = CHAT_SESSIONS.get(sid)
+    return bool(entry and entry['chat'].history)
+
+def record_chat_turn(sid, model_name, user_message, bot_response):
+    """Appends a turn answered without calling Gemini (a replayed cached response) to sid's chat session."""
+    model = get_generative_model(model_name)
+    chat = get_chat_session(sid, (model_name, None), model)
+    chat.history = chat.history + [
+        {'role': 'user', 'parts': [user_message]},
+        {'role': 'model', 'parts': [bot_response]},
+    ]
+
+def drop_chat_session(sid):
+    """Forgets a browser session's chat, e.g. after a failed or interrupted turn."""
+    with CHAT_SESSIONS_LOCK:
+        CHAT_SESSIONS.pop(sid, None)
+
+
+# --- Response Caching ---
+def response_cache_key(model_name, prompt):
+    """Key for RESPONSE_CACHE: the same prompt to the same model."""
+    return hashlib.sha256(f"{model_name}\0{prompt}".encode('utf-8')).digest()
+
+def get_cached_response(key):
+    """Returns the stored bot response for key, or None on a miss."""
+    with RESPONSE_CACHE_LOCK:
+        response = RESPONSE_CACHE.get(key)
+        if response is not None:
+            RESPONSE_CACHE.move_to_end(key)
+        return response
+
+def store_cached_response(key, response):
+    """Remembers a complete bot response, evicting the least recently used entries."""
+    with RESPONSE_CACHE_LOCK:
+        RESPONSE_CACHE[key] = response
+        RESPONSE_CACHE.move_to_end(key)
+        while len(RESPONSE_CACHE) > RESPONSE_CACHE_MAX_ENTRIES:
+            RESPONSE_CACHE.popitem(last=False)
+
+
+# --- History Pagination ---
+def day_range(date_str):
+    """
+    Returns the half-open [start, end) timestamp bounds of a YYYY-MM-DD day. Comparing the raw
+    timestamp column against them lets SQLite seek idx_history_ts, which also provides the
+    ORDER BY; a date_only predicate can only use idx_history_date_only and then has to sort.
+    Raises ValueError for a malformed date.
+    """
+    next_day = datetime.strptime(date_str, '%Y-%m-%d') + timedelta(days=1)
+    return date_str, next_day.strftime('%Y-%m-%d')
+
+def get_history_cursor():
+    """Reads the (timestamp, id) keyset cursor from the before_ts/before_id query parameters, if present."""
+    before_ts = request.args.get('before_ts')
+    before_id = request.args.get('before_id', type=int)
+    if before_ts and before_id is not None:
+        return before_ts, before_id
+    return None
+
+def fetch_history_page(cursor, selected_date=None, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Returns up to limit + 1 history rows, newest first, optionally limited to one day
+    and to rows strictly older than the (timestamp, id) cursor `before`.
+    The extra row only signals that an older page exists.
+    """
+    conditions, params = [], []
+    if selected_date:
+        conditions.append("timestamp >= ? AND timestamp < ?")
+        params.extend(day_range(selected_date))
+    if before:
+        # Keyset pagination: seeks past the previous page instead of counting rows like OFFSET
+        conditions.append("(timestamp, id) < (?, ?)")
+        params.extend(before)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    cursor.execute(
+        f"SELECT id, user_message, bot_response, timestamp FROM history {where}ORDER BY timestamp DESC, id DESC LIMIT ?",
+        (*params, limit + 1)
+    )
+    return cursor.fetchall()
+
+def history_page_json(rows, limit, chronological=False):
+    """
+    Builds the JSON body for a page of plain-tuple rows from fetch_history_page: the first `limit`
+    messages HTML-escaped (newest first, or oldest first if chronological) and the next_cursor
+    for the page after them, or None when there are no older rows.
+    """
+    page_rows = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last_id, _, _, last_timestamp = page_rows[-1]
+        next_cursor = {'before_ts': last_timestamp, 'before_id': last_id}
+    if chronological:
+        page_rows.reverse()
+    escape = escape_html # Local lookup in the loop below
+    history_list = [{
+        # HTML encode both user message and bot response
+        'user_message': str(escape(user_message)),
+        'bot_response': str(escape(bot_response)),
+        'timestamp': timestamp
+    } for _, user_message, bot_response, timestamp in page_rows]
+    return {'history': history_list, 'next_cursor': next_cursor}
+
+
 # --- Flask Routes ---
 
 @app.route('/')
 def index():
-    """Render the main chat page and load history, optionally filtered by date."""
-    conn = get_db()
-    cursor = conn.cursor()
-
-    # Get distinct dates for the dropdown
-    cursor.execute("SELECT DISTINCT DATE(timestamp) as chat_date FROM history ORDER BY chat_date DESC")
-    available_dates = [row['chat_date'] for row in cursor.fetchall()]
-
-    # Get selected date from query parameters
-    selected_date = request.args.get('date')
+    """Render the main chat page and load history, optionally filtered by date and paginated."""
+    with get_db() as conn:
+        cursor = conn.cursor()
 
-    # Fetch and encode history
-    if selected_date:
-        try:
-            datetime.strptime(selected_date, '%Y-%m-%d')
-            cursor.execute(
-                "SELECT user_message, bot_response, timestamp FROM history WHERE DATE(timestamp) = ? ORDER BY timestamp ASC",
-                (selected_date,)
-            )
-        except ValueError:
-            cursor.execute("SELECT user_message, bot_response, timestamp FROM history ORDER BY timestamp ASC")
-            selected_date = None
-    else:
-        cursor.execute("SELECT user_message, bot_response, timestamp FROM history ORDER BY timestamp ASC")
-
-    # HTML encode the history data
-    history = [{
-        'user_message': html.escape(row['user_message']),
-        'bot_response': html.escape(row['bot_response']),
-        'timestamp': row['timestamp']
-    } for row in cursor.fetchall()]
-    
-    conn.close()
-    
-    return render_template(
+        # Cheap fingerprint of what the page shows: a new row bumps MAX(id), a deletion changes COUNT(*),
+        # and a model list refresh changes the checksum. Repeat loads of an unchanged page get a 304.
+        max_id, row_count = cursor.execute("SELECT MAX(id), COUNT(*) FROM history").fetchone()
+        etag = f"{max_id}-{row_count}-{zlib.crc32(','.join(FETCHED_MODELS).encode('utf-8')):08x}"
+        if etag in request.if_none_match:
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag)
+            return not_modified
+
+        # Get distinct dates for the dropdown
+        cursor.execute("SELECT DISTINCT date_only as chat_date FROM history ORDER BY chat_date DESC")
+        available_dates = [row['chat_date'] for row in cursor.fetchall()]
+
+        # Get selected date and page cursor (none = most recent messages) from query parameters
+        selected_date = request.args.get('date')
+        if selected_date:
+            try:
+                datetime.strptime(selected_date, '%Y-%m-%d')
+            except ValueError:
+                selected_date = None
+        rows = fetch_history_page(cursor, selected_date, get_history_cursor())
+
+    page_rows = rows[:HISTORY_PAGE_SIZE]
+    # Keyset cursor for the "Load older messages" link: the oldest row shown
+    older_cursor = (page_rows[-1]['timestamp'], page_rows[-1]['id']) if len(rows) > HISTORY_PAGE_SIZE else None
+    # Back in chronological order for display; the template's autoescaping HTML-encodes the messages
+    history = [dict(row) for row in reversed(page_rows)]
+
+    response = make_response(render_template(
         'index.html',
         history=history,
         available_dates=available_dates,
         selected_date=selected_date,
+        older_cursor=older_cursor,
         available_models=FETCHED_MODELS,
         default_model=DEFAULT_MODEL_NAME,
         usage_limits=FREE_TIER_LIMITS
-    )
+    ))
+    response.set_etag(etag)
+    return response
 
 @app.route('/chat', methods=['POST'])
 def chat_endpoint():
     """Handle incoming chat messages and stream responses."""
-    global FETCHED_MODELS  # Add this line
     if not API_KEY:
          return Response(json.dumps({"error": "Gemini API Key not configured."}), status=500, mimetype='application/json')
 
@@ -460,15 +941,11 @@ def chat_endpoint():
     active_context_items = data.get('active_context', []) # Get active context list
     selected_model_name = data.get('model_name', DEFAULT_MODEL_NAME) # Get selected model or use default
 
-    # Validate selected model against the fetched list
-    if selected_model_name not in FETCHED_MODELS:
-        # Attempt to refresh the list in case it changed since startup
-        # Removed unnecessary global declaration
-        print("Selected model not in known list, attempting to refresh...")
-        FETCHED_MODELS = get_available_models(API_KEY)
-        if selected_model_name not in FETCHED_MODELS:
-             print(f"Error: Invalid model selected even after refresh: {selected_model_name}")
-             return Response(json.dumps({"error": f"Invalid model selected: {selected_model_name}"}), status=400, mimetype='application/json')
+    # Validate selected model against the fetched list; a stale list is refreshed off the request path
+    refresh_models_if_stale()
+    if selected_model_name not in FETCHED_MODELS_SET:
+        print(f"Error: Invalid model selected: {selected_model_name}")
+        return Response(json.dumps({"error": f"Invalid model selected: {selected_model_name}"}), status=400, mimetype='application/json')
 
     if not user_message:
         return Response(json.dumps({"error": "No message provided."}), status=400, mimetype='application/json')
@@ -478,7 +955,7 @@ def chat_endpoint():
         return Response(json.dumps({"error": "No message provided."}), status=400, mimetype='application/json')
 
     # --- Process Active Context Items ---
-    full_context_str = ""
+    context_parts = [] # Successful context pieces, joined once below
     context_errors = []
     processed_paths_info = [] # To store info for DB logging
 
@@ -492,7 +969,7 @@ def chat_endpoint():
                 if error:
                     context_errors.append(error) # Collect errors
                 if context_part:
-                    full_context_str += context_part # Add successful context
+                    context_parts.append(context_part) # Add successful context
             else:
                 # Process file/folder paths
                 context_part, error, path_info = process_context_path(item_path)
@@ -500,10 +977,11 @@ def chat_endpoint():
                 if error:
                     context_errors.append(error) # Collect errors
                 if context_part:
-                    full_context_str += context_part # Add successful context
+                    context_parts.append(context_part) # Add successful context
 
     # --- Construct Final Prompt ---
     # Prepend the gathered context to the user's message
+    full_context_str = "".join(context_parts)
     final_prompt = full_context_str + user_message
 
     # Store original user message and context info for DB
@@ -514,67 +992,134 @@ def chat_endpoint():
     if not final_prompt.strip() and not context_errors:
          return Response(json.dumps({"error": "Cannot send an empty message."}), status=400, mimetype='application/json')
 
+    # Chat session for this browser; the cookie is set on the response below if it is new
+    sid = request.cookies.get('sid')
+    new_sid = None
+    if not sid:
+        sid = new_sid = secrets.token_urlsafe(16)
+
+    # Rough estimate (~4 characters per token) so oversized prompts fail fast instead of tying up a stream
+    approx_prompt_tokens = len(final_prompt) >> 2
+    if approx_prompt_tokens > MAX_PROMPT_TOKENS:
+        print(f"Rejecting prompt of ~{approx_prompt_tokens} tokens (limit {MAX_PROMPT_TOKENS}).")
+        return Response(json.dumps({"error": f"Prompt too large (~{approx_prompt_tokens} tokens, limit {MAX_PROMPT_TOKENS}). Remove some context items."}), status=413, mimetype='application/json')
+
+    # Opt-in (?cache=1): replay the previous answer to an identical prompt instead of calling Gemini again.
+    # Only used for a session's first turn: later answers also depend on the history, which isn't in the key.
+    response_key = response_cache_key(selected_model_name, final_prompt) if request.args.get('cache') == '1' else None
+
     # --- Streaming Response ---
     def generate_response():
-        full_bot_response = ""
+        # One turn at a time per session: concurrent turns would interleave in the shared history
+        if not acquire_chat_session(sid):
+            yield sse_event({"error": "Still answering your previous message. Please wait for it to finish."})
+            return
+        response_parts = [] # Streamed text chunks, joined once the stream ends
         try:
-            # Start a new chat session for each request OR manage sessions if needed
-            # For simplicity, starting fresh each time. For history continuity with Gemini,
-            # you'd need session management (e.g., using Flask sessions or a cache).
-            # Let's assume the Gemini library handles history internally for a `chat` object
-            # If not, we need to pass history manually. The current GeminiChatBot.py starts fresh.
-            # Let's stick to the simpler approach first: stateless requests.
+            use_response_cache = response_key is not None and not chat_session_has_history(sid)
+            cached_response = get_cached_response(response_key) if use_response_cache else None
+            if cached_response is not None:
+                print(f"Serving cached response for model: {selected_model_name}")
+                if context_errors:
+                    yield sse_event({"context_error": "\n".join(context_errors)})
+                yield SSE_TEXT_PREFIX + encode_json_string(cached_response).encode('ascii') + SSE_TEXT_SUFFIX
+                record_chat_turn(sid, selected_model_name, user_message, cached_response) # So the next turn sees it
+                _history_write_queue.put((original_user_message_for_db, cached_response, context_info_json))
+                yield sse_event({'end_stream': True, 'cached_response': True})
+                return
+
             # Instantiate the model based on user selection for this request
             try:
-                current_model = genai.GenerativeModel(selected_model_name)
+                # Large contexts are served from an explicit Gemini cache so repeated
+                # turns over the same files/URLs skip re-sending and re-processing them.
+                current_model = get_cached_context_model(selected_model_name, full_context_str) if full_context_str else None
+                if current_model:
+                    prompt_to_send = user_message # Context is already part of the cached prefix
+                    context_sent_inline = False
+                else:
+                    current_model = get_generative_model(selected_model_name)
+                    prompt_to_send = final_prompt
+                    context_sent_inline = bool(full_context_str)
                 print(f"Using model: {selected_model_name} for chat request.") # Log model usage
             except Exception as e:
                  print(f"Error instantiating model '{selected_model_name}': {e}")
-                 yield f"data: {json.dumps({'error': f'Failed to load model {selected_model_name}: {e}'})}\n\n"
+                 yield sse_event({'error': f'Failed to load model {selected_model_name}: {e}'})
                  return # Stop generation
 
+            # Continue this browser's chat session; a new cached context starts a fresh one
+            model_key = (selected_model_name, getattr(current_model, 'cached_content', None))
+            chat = get_chat_session(sid, model_key, current_model)
             # To enable streaming: use stream=True
-            stream = current_model.generate_content(final_prompt, stream=True)
+            stream = chat.send_message(prompt_to_send, stream=True)
 
             # Send context errors first, if any
             if context_errors:
-                error_data = json.dumps({"context_error": "\n".join(context_errors)})
-                yield f"data: {error_data}\n\n"
+                yield sse_event({"context_error": "\n".join(context_errors)})
 
+            cached_token_count = 0
             for chunk in stream:
-                if chunk.text:
-                    full_bot_response += chunk.text
-                    # Send chunk to client via SSE
-                    data = json.dumps({"text": chunk.text})
-                    yield f"data: {data}\n\n" # SSE format: data: <json_string>\n\n
+                usage = getattr(chunk, 'usage_metadata', None)
+                if usage and getattr(usage, 'cached_content_token_count', 0):
+                    cached_token_count = usage.cached_content_token_count
+                text = chunk.text # Property that re-joins the chunk's parts on every access
+                if text:
+                    response_parts.append(text)
+                    # Send chunk to client via SSE (data: {"text": ...}\n\n), framed as pre-encoded bytes
+                    yield SSE_TEXT_PREFIX + encode_json_string(text).encode('ascii') + SSE_TEXT_SUFFIX
+            full_bot_response = "".join(response_parts)
+
+            if context_sent_inline:
+                # Keep only the bare message in the session; active context is re-sent with each turn
+                history = chat.history
+                history[-2] = {'role': 'user', 'parts': [user_message]}
+                chat.history = history
 
             # --- Save to Database ---
-            # Save after the full response is generated
-            conn = get_db()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO history (user_message, bot_response, context_info) VALUES (?, ?, ?)",
-                (original_user_message_for_db, full_bot_response, context_info_json) # Store original message + context info
-            )
-            conn.commit()
-            conn.close()
-            print(f"Saved interaction: User: '{user_message[:50]}...', Bot: '{full_bot_response[:50]}...'")
+            # Queue the save once the full response is generated; the history writer thread commits it
+            _history_write_queue.put((original_user_message_for_db, full_bot_response, context_info_json)) # Original message + context info
+            if use_response_cache:
+                store_cached_response(response_key, full_bot_response)
 
             # Signal end of stream (optional, depends on client handling)
-            yield f"data: {json.dumps({'end_stream': True})}\n\n"
+            print(f"Prompt ~{approx_prompt_tokens} tokens, {cached_token_count} served from context cache.")
+            yield sse_event({'end_stream': True, 'approx_prompt_tokens': approx_prompt_tokens, 'cached_content_token_count': cached_token_count})
 
         except Exception as e:
             print(f"Error during Gemini generation or DB save: {e}")
+            drop_chat_session(sid) # A half-finished turn would leave the session history unusable
             # Send error to client via SSE
-            error_data = json.dumps({"error": f"An error occurred: {e}"})
-            yield f"data: {error_data}\n\n"
+            yield sse_event({"error": f"An error occurred: {e}"})
             # Also save the error state? Maybe not, depends on requirements.
+        finally:
+            release_chat_session(sid) # Also runs when the client disconnects and the generator is closed
 
     # Use stream_with_context for generators that access request context
-    return Response(stream_with_context(generate_response()), mimetype='text/event-stream')
+    response = Response(stream_with_context(generate_response()), mimetype='text/event-stream')
+    if new_sid:
+        response.set_cookie('sid', new_sid, httponly=True, samesite='Lax')
+    return response
 
 
 # --- Image to PDF Conversion Route ---
+JPEG_SOI_MARKER = b'\xff\xd8\xff' # Every JPEG file starts with these bytes
+# Shared by all /convert requests, so concurrent uploads queue for the CPUs instead of each
+# starting a tesseract per core and starving every other request
+OCR_EXECUTOR = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="ocr")
+
+def ocr_images_to_pdf(image_paths):
+    """
+    OCRs several image files in a single tesseract run and returns one searchable, multi-page PDF.
+    Tesseract treats a .txt input as a list of images, one path per line.
+    """
+    list_path = os.path.splitext(image_paths[0])[0] + '_list.txt'
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(image_paths) + '\n')
+    return pytesseract.image_to_pdf_or_hocr(list_path, extension='pdf')
+
+# OCR_EXECUTOR already runs up to one tesseract (one batch list-file each) per CPU; keep each process
+# single-threaded so its OpenMP threads don't oversubscribe the CPUs on top of that
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
 @app.route('/convert', methods=['POST'])
 def convert_images_to_pdf():
     """Handles multiple image uploads and converts them to a single PDF, optionally with OCR."""
@@ -588,7 +1133,7 @@ def convert_images_to_pdf():
     # Check if OCR is requested (convert string 'true'/'false' to boolean)
     ocr_enabled = request.form.get('ocr_enabled', 'false').lower() == 'true'
 
-    processed_files = [] # Store validated image data (bytes or PIL Image objects)
+    processed_files = [] # Store validated image data (JPEG bytes)
     allowed_extensions = {'jpeg', 'jpg'}
 
     for file in files:
@@ -599,15 +1144,18 @@ def convert_images_to_pdf():
 
         try:
             img_bytes = file.read()
-            # Validate image format using Pillow
-            img = Image.open(BytesIO(img_bytes))
-            if img.format.lower() not in ['jpeg']:
+            if not img_bytes.startswith(JPEG_SOI_MARKER):
                 return jsonify({"error": f"Invalid image format detected in file: {file.filename}. Only JPEG/JPG allowed."}), 400
-            img.verify() # Verify image integrity (re-open after verify)
-            img = Image.open(BytesIO(img_bytes)) # Re-open image after verification
+            if ocr_enabled:
+                # Tesseract fails the whole batch on a bad page, so check integrity with Pillow up front.
+                # img2pdf parses the JPEG headers itself, so the plain conversion skips this.
+                img = Image.open(BytesIO(img_bytes))
+                if img.format.lower() not in ['jpeg']:
+                    return jsonify({"error": f"Invalid image format detected in file: {file.filename}. Only JPEG/JPG allowed."}), 400
+                img.verify() # Verify image integrity
 
-            # Store either bytes (for img2pdf) or PIL image (for pytesseract)
-            processed_files.append(img if ocr_enabled else img_bytes)
+            # Store the original bytes: img2pdf embeds them as-is and OCR reads them from disk
+            processed_files.append(img_bytes)
 
         except Exception as e:
             print(f"Error processing file {file.filename}: {e}")
@@ -616,49 +1164,85 @@ def convert_images_to_pdf():
     if not processed_files:
         return jsonify({"error": "No valid JPEG images found to convert"}), 400
 
+    # Small PDFs stay in memory; larger ones roll over to a temp file, so the response is served
+    # from disk in chunks instead of holding the whole document in RAM. send_file closes it when done.
+    output_pdf_stream = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
     try:
-        output_pdf_stream = BytesIO()
-
         if ocr_enabled:
             # --- OCR Path ---
-            merger = PdfMerger()
+            # QPDF-backed merge: page objects are copied natively instead of re-parsed into Python objects
+            merged_pdf = pikepdf.Pdf.new()
+            batch_pdfs = [] # Each source must stay open until the merged PDF is saved
             try:
-                for i, img in enumerate(processed_files):
-                    # Create searchable PDF for each image in memory
-                    pdf_data = pytesseract.image_to_pdf_or_hocr(img, extension='pdf')
-                    pdf_stream = BytesIO(pdf_data)
-                    merger.append(pdf_stream)
-                    print(f"Processed image {i+1} with OCR.")
+                with tempfile.TemporaryDirectory(prefix='ocr_') as tmpdir:
+                    image_paths = []
+                    for i, img_bytes in enumerate(processed_files):
+                        image_path = os.path.join(tmpdir, f"page_{i:04d}.jpg")
+                        with open(image_path, 'wb') as f:
+                            f.write(img_bytes)
+                        image_paths.append(image_path)
+
+                    # One contiguous batch per worker, so tesseract starts (and loads its model) once per batch
+                    # rather than once per image; batches still run in parallel and map() keeps the page order
+                    workers = min(len(image_paths), os.cpu_count() or 4)
+                    batch_size = -(-len(image_paths) // workers) # Ceiling division
+                    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+                    for pdf_data in OCR_EXECUTOR.map(ocr_images_to_pdf, batches):
+                        batch_pdf = pikepdf.Pdf.open(BytesIO(pdf_data))
+                        batch_pdfs.append(batch_pdf)
+                        merged_pdf.pages.extend(batch_pdf.pages)
+                    print(f"Processed {len(image_paths)} image(s) with OCR in {len(batches)} tesseract run(s).")
                 # Write the merged PDF to the output stream
-                merger.write(output_pdf_stream)
-                merger.close()
+                merged_pdf.save(output_pdf_stream)
             except pytesseract.TesseractNotFoundError:
                  print("TesseractNotFoundError: Tesseract is not installed or not in your PATH.")
+                 output_pdf_stream.close()
                  return jsonify({"error": "OCR Error: Tesseract is not installed or not found. Please install Tesseract and ensure it's in your system's PATH."}), 500
             except Exception as ocr_error:
                  print(f"Error during OCR processing: {ocr_error}")
+                 output_pdf_stream.close()
                  return jsonify({"error": f"An error occurred during OCR processing: {ocr_error}"}), 500
+            finally:
+                for batch_pdf in batch_pdfs:
+                    batch_pdf.close()
+                merged_pdf.close()
         else:
             # --- Non-OCR Path (using img2pdf) ---
-            pdf_bytes = img2pdf.convert(processed_files) # processed_files contains bytes here
-            output_pdf_stream = BytesIO(pdf_bytes)
+            # Serialize straight into the output file instead of building a bytes copy first
+            img2pdf.convert(processed_files, outputstream=output_pdf_stream) # processed_files contains bytes here
 
         # Reset stream position before sending
+        pdf_size = output_pdf_stream.tell()
         output_pdf_stream.seek(0)
 
         # Send the final PDF file back to the client
-        return send_file(
+        response = send_file(
             output_pdf_stream,
             mimetype='application/pdf',
             as_attachment=True,
             download_name='converted_images.pdf'
         )
+        response.content_length = pdf_size # send_file can't size a spooled file on its own
+        return response
 
     except Exception as e:
         print(f"Error during PDF generation/sending: {e}")
+        output_pdf_stream.close()
         return jsonify({"error": f"PDF generation failed: {e}"}), 500
 
-# --- Delete History Route ---
+# --- Summarize Context Route ---
+# Fixed instructions wrapped around the gathered context of a summary request
+SUMMARY_PROMPT_PREFIX = "Please provide a concise summary of the following context:\n        \n"
+SUMMARY_PROMPT_SUFFIX = """
+
+Focus on:
+1. Main topics or themes
+2. Key files/components and their relationships
+3. Important code structures or patterns
+4. Any notable features or configurations
+
+Keep the summary clear and well-organized."""
+
 @app.route('/summarize_context', methods=['POST'])
 def summarize_context():
     """Summarize a list of provided context items (files/folders/URLs)."""
@@ -671,19 +1255,26 @@ def summarize_context():
         return jsonify({"error": "Empty context items list"}), 400
 
     # Process each context item and gather their content
-    full_context = ""
+    context_parts = [] # Successful context pieces, joined once below
     errors = []
     processed_paths_info_summary = [] # Separate tracking for summary context
 
+    # Fetch all URLs concurrently (pure network waits); results are consumed in item order below
+    url_items = [item for item in context_items if item.startswith(('http://', 'https://'))]
+    url_results = {}
+    if url_items:
+        with ThreadPoolExecutor(max_workers=min(MAX_URL_FETCH_WORKERS, len(url_items))) as executor:
+            url_results = dict(zip(url_items, executor.map(fetch_and_process_url, url_items)))
+
     for item in context_items:
-        if item.startswith('http://') or item.startswith('https://'):
-            # Fetch and process URL content
-            context_part, error, path_info = fetch_and_process_url(item)
+        if item in url_results:
+            # Already fetched above
+            context_part, error, path_info = url_results[item]
             processed_paths_info_summary.append(path_info)
             if error:
                 errors.append(error) # Collect errors
             if context_part:
-                full_context += context_part # Add successful context
+                context_parts.append(context_part) # Add successful context
         else:
             # For files/folders, use our existing context processing
             context_part, error, path_info = process_context_path(item)
@@ -691,38 +1282,28 @@ def summarize_context():
             if error:
                 errors.append(error)
             if context_part:
-                full_context += context_part
+                context_parts.append(context_part)
 
-    if not full_context:
+    if not context_parts:
         if errors:
             return jsonify({"error": "Failed to process context items", "details": errors}), 400
         return jsonify({"error": "No content found in provided context items"}), 400
 
     # Get selected model from request or use default (passed in data for consistency)
     selected_model_name = data.get('model_name', DEFAULT_MODEL_NAME)
-    if selected_model_name not in FETCHED_MODELS:
+    if selected_model_name not in FETCHED_MODELS_SET:
          # Don't refresh here, just return error if invalid model was sent
          return jsonify({"error": f"Invalid model selected for summary: {selected_model_name}"}), 400
 
     try:
-        # Instantiate the selected model
+        # Reuse the process-wide model instance for the selected model
         print(f"Using model: {selected_model_name} for summary request.") # Log model usage
-        current_model = genai.GenerativeModel(selected_model_name)
-
-        # Create a prompt that asks for a summary
-        prompt = f"""Please provide a concise summary of the following context:
-        
-{full_context}
-
-Focus on:
-1. Main topics or themes
-2. Key files/components and their relationships
-3. Important code structures or patterns
-4. Any notable features or configurations
+        current_model = get_generative_model(selected_model_name)
 
-Keep the summary clear and well-organized."""
+        # Create a prompt that asks for a summary; one join copies each context part exactly once
+        prompt = "".join([SUMMARY_PROMPT_PREFIX, *context_parts, SUMMARY_PROMPT_SUFFIX])
 
-        response = genai.model.generate_content(prompt)
+        response = current_model.generate_content(prompt)
         summary = response.text
 
         if errors:
@@ -739,57 +1320,68 @@ Keep the summary clear and well-organized."""
 
 @app.route('/fetch_history', methods=['GET'])
 def fetch_history():
-    """Fetch chat history for a specific date or all history."""
+    """
+    Fetch the latest ?limit= (default HISTORY_PAGE_SIZE) chat messages for a specific date or all
+    history, in chronological order. Older messages are fetched by passing back next_cursor's
+    before_ts/before_id.
+    """
     selected_date = request.args.get('date')
-    conn = get_db()
-    cursor = conn.cursor()
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    if not 1 <= limit <= MAX_HISTORY_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_HISTORY_PAGE_SIZE}'}), 400
 
     try:
         if selected_date:
             # Validate date format
             datetime.strptime(selected_date, '%Y-%m-%d')
-            cursor.execute(
-                "SELECT user_message, bot_response, timestamp FROM history WHERE DATE(timestamp) = ? ORDER BY timestamp ASC",
-                (selected_date,)
-            )
-        else:
-            cursor.execute("SELECT user_message, bot_response, timestamp FROM history ORDER BY timestamp ASC")
-
-        history = cursor.fetchall()
-        history_list = []
-        
-        for row in history:
-            # HTML encode both user message and bot response
-            history_list.append({
-                'user_message': html.escape(row['user_message']),
-                'bot_response': html.escape(row['bot_response']),
-                'timestamp': row['timestamp']
-            })
-        
-        return jsonify({'history': history_list})
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None # Plain tuples; rows are unpacked, not looked up by name
+            # Newest first, so SQLite stops after limit + 1 rows on idx_history_ts
+            rows = fetch_history_page(cursor, selected_date, get_history_cursor(), limit)
+
+        # Back to chronological order for display
+        return jsonify(history_page_json(rows, limit, chronological=True))
     except ValueError:
         return jsonify({'error': 'Invalid date format'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        conn.close()
 
+@app.route('/history', methods=['GET'])
+def history_page():
+    """Return one page of history (newest first) as JSON, for lazy-loading older messages."""
+    selected_date = request.args.get('date')
+    if selected_date:
+        try:
+            datetime.strptime(selected_date, '%Y-%m-%d')
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None # Plain tuples; rows are unpacked, not looked up by name
+            rows = fetch_history_page(cursor, selected_date, get_history_cursor())
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify(history_page_json(rows, HISTORY_PAGE_SIZE))
+
+# --- Delete History Route ---
 @app.route('/delete_history/<string:date_str>', methods=['DELETE'])
 def delete_history(date_str):
     """Delete chat history for a specific date."""
     try:
-        # Validate date format
-        datetime.strptime(date_str, '%Y-%m-%d')
+        # Validates the date format too
+        day_start, day_end = day_range(date_str)
     except ValueError:
         return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
 
-    conn = None # Initialize conn to None
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM history WHERE DATE(timestamp) = ?", (date_str,))
-        conn.commit()
-        deleted_count = cursor.rowcount # Get the number of deleted rows
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM history WHERE timestamp >= ? AND timestamp < ?", (day_start, day_end))
+            deleted_count = cursor.rowcount # Get the number of deleted rows
         print(f"Deleted {deleted_count} entries for date: {date_str}")
         return jsonify({"success": True, "message": f"Deleted history for {date_str}.", "deleted_count": deleted_count}), 200
     except sqlite3.Error as e:
@@ -798,65 +1390,140 @@ def delete_history(date_str):
     except Exception as e:
         print(f"Unexpected error deleting history for {date_str}: {e}")
         return jsonify({"error": f"An unexpected error occurred: {e}"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 
 # --- Context Menu Helper Routes ---
 
+def scan_allowed_tree():
+    """
+    Walks ALLOWED_CONTEXT_DIR with os.scandir and returns (files, folders, dir_mtimes): sorted paths
+    relative to it, using forward slashes for display, folders with a trailing slash, plus the
+    mtime of every directory read (any entry added, removed or renamed changes its folder's mtime).
+    Like os.walk, symlinked folders are listed but not descended into, and unreadable folders are skipped.
+    """
+    files, folders = [], []
+    dir_mtimes = {}
+    prefix_len = len(ALLOWED_CONTEXT_PREFIX) # entry.path starts with the allowed dir, so slicing replaces relpath()
+    pending = [ALLOWED_CONTEXT_DIR]
+    while pending:
+        dir_path = pending.pop()
+        try:
+            dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns # Taken before reading, so a change mid-scan is caught next time
+            it = os.scandir(dir_path)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                relative_path = entry.path[prefix_len:].replace(os.sep, '/')
+                try:
+                    is_dir = entry.is_dir() # Cached from the directory read on most filesystems
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    folders.append(relative_path + '/')
+                    if not entry.is_symlink(): # Never leave the allowed dir through a link
+                        pending.append(entry.path)
+                else:
+                    files.append(relative_path)
+    files.sort()
+    folders.sort()
+    return files, folders, dir_mtimes
+
+_tree_listing_cache = None # Last scan: {'files', 'folders', 'dir_mtimes', 'bodies'}
+
+def get_allowed_tree_listing():
+    """
+    Returns the listing of ALLOWED_CONTEXT_DIR as a dict with 'files' and 'folders', rescanning only
+    when a directory in the tree changed since the last scan; otherwise it costs one stat() per directory.
+    'bodies' holds the serialized responses for this scan (see listing_response).
+    """
+    global _tree_listing_cache
+    cached = _tree_listing_cache
+    if cached is not None:
+        try:
+            if all(os.stat(path).st_mtime_ns == mtime for path, mtime in cached['dir_mtimes'].items()):
+                return cached
+        except OSError: # A directory disappeared
+            pass
+    files, folders, dir_mtimes = scan_allowed_tree()
+    _tree_listing_cache = cached = {'files': files, 'folders': folders, 'dir_mtimes': dir_mtimes, 'bodies': {}}
+    return cached
+
+def listing_response(kind):
+    """
+    Returns the 'files' or 'folders' listing as a JSON response. The body is serialized and gzipped
+    once per scan, carries an ETag, and repeat requests with a matching If-None-Match get a 304.
+    """
+    listing = get_allowed_tree_listing()
+    body = listing['bodies'].get(kind)
+    if body is None:
+        raw = orjson.dumps(listing[kind]) if orjson is not None else json.dumps(listing[kind]).encode('utf-8')
+        body = listing['bodies'][kind] = (
+            hashlib.blake2b(raw, digest_size=8).hexdigest(),
+            raw,
+            gzip.compress(raw, compresslevel=6) # Paths share long prefixes, so this shrinks well
+        )
+    etag, raw, gzipped = body
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(raw, mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@functools.lru_cache(maxsize=256)
+def list_dir_entries(dir_path, mtime_ns):
+    """
+    Returns (folded_names, entries) for dir_path: a tuple of casefolded names in sorted order and a
+    parallel tuple of (name, is_dir), so a prefix's matches can be found by bisecting folded_names.
+    mtime_ns is part of the cache key only, so passing the directory's current mtime invalidates the
+    entry when its contents change.
+    """
+    entries = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append((entry.name.casefold(), entry.name, is_dir))
+    entries.sort()
+    return tuple(folded for folded, _, _ in entries), tuple((name, is_dir) for _, name, is_dir in entries)
+
 @app.route('/list_files')
 def list_files_endpoint():
     """Recursively list all files within ALLOWED_CONTEXT_DIR."""
-    all_files = []
     if not ALLOWED_CONTEXT_DIR or not os.path.exists(ALLOWED_CONTEXT_DIR):
         print(f"Warning: ALLOWED_CONTEXT_DIR ('{ALLOWED_CONTEXT_DIR}') not found for listing files.")
         return jsonify([])
 
     try:
-        for root, dirs, files in os.walk(ALLOWED_CONTEXT_DIR):
-            # Security: Skip if root somehow goes outside allowed dir (shouldn't happen with os.walk)
-            if not os.path.realpath(root).lower().startswith(ALLOWED_CONTEXT_DIR.lower()):
-                continue
-            for filename in files:
-                full_path = os.path.join(root, filename)
-                relative_path = os.path.relpath(full_path, ALLOWED_CONTEXT_DIR)
-                # Use forward slashes for display
-                all_files.append(relative_path.replace(os.path.sep, '/'))
+        return listing_response('files')
     except Exception as e:
         print(f"Error listing files in '{ALLOWED_CONTEXT_DIR}': {e}")
         return jsonify({"error": f"Failed to list files: {e}"}), 500
 
-    return jsonify(sorted(all_files))
-
 @app.route('/list_folders')
 def list_folders_endpoint():
     """Recursively list all folders within ALLOWED_CONTEXT_DIR."""
-    all_folders = []
     if not ALLOWED_CONTEXT_DIR or not os.path.exists(ALLOWED_CONTEXT_DIR):
         print(f"Warning: ALLOWED_CONTEXT_DIR ('{ALLOWED_CONTEXT_DIR}') not found for listing folders.")
         return jsonify([])
 
+    # Add the root directory itself if needed (represented as './' or just '/')
+    # Let's keep it simple and only list subfolders for now.
+    # If the root itself needs to be selectable, the frontend logic might need adjustment.
     try:
-        for root, dirs, files in os.walk(ALLOWED_CONTEXT_DIR):
-             # Security: Skip if root somehow goes outside allowed dir
-            if not os.path.realpath(root).lower().startswith(ALLOWED_CONTEXT_DIR.lower()):
-                continue
-            for dirname in dirs:
-                full_path = os.path.join(root, dirname)
-                relative_path = os.path.relpath(full_path, ALLOWED_CONTEXT_DIR)
-                # Use forward slashes and add trailing slash for display
-                all_folders.append(relative_path.replace(os.path.sep, '/') + '/')
+        return listing_response('folders')
     except Exception as e:
         print(f"Error listing folders in '{ALLOWED_CONTEXT_DIR}': {e}")
         return jsonify({"error": f"Failed to list folders: {e}"}), 500
 
-    # Add the root directory itself if needed (represented as './' or just '/')
-    # Let's keep it simple and only list subfolders for now.
-    # If the root itself needs to be selectable, the frontend logic might need adjustment.
-
-    return jsonify(sorted(all_folders))
-
 
 # --- Path Suggestion Route (Kept for potential future use or different trigger) ---
 @app.route('/suggest_path')
@@ -875,7 +1542,7 @@ def suggest_path():
         normalized_partial = os.path.normpath(partial_path.strip().strip("'\""))
 
         # Prevent accessing parent directories or absolute paths
-        if os.path.isabs(normalized_partial) or ".." in normalized_partial.split(os.path.sep):
+        if os.path.isabs(normalized_partial) or has_parent_dir_component(normalized_partial):
             return jsonify([]) # Return empty for invalid/unsafe paths
 
         # Determine the directory to search and the prefix to match
@@ -887,33 +1554,38 @@ def suggest_path():
             # User is typing at the root of allowed_context
             base_dir_part = ""
             search_prefix = normalized_partial
-            search_dir = ALLOWED_CONTEXT_DIR
+            search_dir = ALLOWED_CONTEXT_REAL
 
-        # Security Check: Ensure the search directory is still within the allowed directory
-        if not search_dir.startswith(ALLOWED_CONTEXT_DIR + os.path.sep) and search_dir != ALLOWED_CONTEXT_DIR:
+        # Security Check: Ensure the resolved search directory is still within the allowed directory
+        if not is_within_allowed_dir(search_dir):
              print(f"Warning: Suggestion path '{search_dir}' resolved outside allowed directory.")
              return jsonify([])
 
-        if not os.path.isdir(search_dir):
-            return jsonify([]) # Base directory doesn't exist or isn't a directory
-
-        # List items and filter based on the prefix
-        count = 0
-        for item in sorted(os.listdir(search_dir)):
-            if item.lower().startswith(search_prefix.lower()):
-                full_item_path = os.path.join(search_dir, item)
-                # Construct the suggestion path relative to the original partial input
-                suggestion = os.path.join(base_dir_part, item)
-                # Use forward slashes for consistency in suggestions, even on Windows
-                suggestion = suggestion.replace(os.path.sep, '/')
-
-                if os.path.isdir(full_item_path):
-                    suggestions.append(suggestion + "/") # Add trailing slash for directories
-                else:
-                    suggestions.append(suggestion)
-                count += 1
-                if count >= max_suggestions:
-                    break
+        try:
+            search_dir_stat = os.stat(search_dir)
+        except OSError:
+            return jsonify([]) # Base directory doesn't exist
+        if not stat.S_ISDIR(search_dir_stat.st_mode):
+            return jsonify([]) # Base directory isn't a directory
+
+        # List items (cached until the directory changes, sorted case-insensitively) and jump straight
+        # to the first one matching the prefix; matches are contiguous, so stop at the first miss
+        search_prefix_folded = search_prefix.casefold()
+        folded_names, entries = list_dir_entries(search_dir, search_dir_stat.st_mtime_ns)
+        start = bisect.bisect_left(folded_names, search_prefix_folded)
+        for i in range(start, min(start + max_suggestions, len(entries))):
+            if not folded_names[i].startswith(search_prefix_folded):
+                break
+            item, item_is_dir = entries[i]
+            # Construct the suggestion path relative to the original partial input
+            suggestion = os.path.join(base_dir_part, item)
+            # Use forward slashes for consistency in suggestions, even on Windows
+            suggestion = suggestion.replace(os.path.sep, '/')
+
+            if item_is_dir:
+                suggestions.append(suggestion + "/") # Add trailing slash for directories
+            else:
+                suggestions.append(suggestion)
 
     except FileNotFoundError:
         # This might happen if the base_dir_part doesn't exist, which is fine.
@@ -932,6 +1604,13 @@ if __name__ == '__main__':
     print("Starting Flask server...")
     print("Ensure GOOGLE_API_KEY is set in a .env file or environment variables.")
     print(f"Database file: {os.path.abspath(DB_NAME)}")
-    # Use debug=True for development, but turn off in production
-    # Use host='0.0.0.0' to make it accessible on the network
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # Development server; set FLASK_DEBUG=1 for the debugger/reloader. In production serve `app:app`
+    # with a WSGI server instead (see README). host='0.0.0.0' makes it accessible on the network
+    if os.getenv("USE_GEVENT") == "1":
+        from gevent.pywsgi import WSGIServer
+        print("Serving with gevent (one greenlet per request).")
+        WSGIServer(('0.0.0.0', 5000), app).serve_forever()
+    else:
+        # threaded=True: each /chat SSE stream holds its own thread while Gemini generates,
+        # so long responses never queue other requests behind them
+        app.run(debug=os.getenv("FLASK_DEBUG") == "1", host='0.0.0.0', port=5000, threaded=True)
@@ -28,13 +28,25 @@ ALLOWED_PDF_EXTENSIONS = {'jpeg', 'jpg'} # For image to PDF conversion
 
 # --- URL Processing ---
 MAX_URL_CONTENT_BYTES = 2 * 1024 * 1024 # Limit URL content size (e.g., 2MB)
+URL_READ_CHUNK_BYTES = 64 * 1024 # Read size when streaming a URL body
 REQUEST_TIMEOUT = 10 # Seconds for URL requests
+MAX_URL_FETCH_WORKERS = 16 # Concurrent URL fetches per chat or summary request
+URL_CACHE_MAX_ENTRIES = 128 # Extracted URL texts kept for ETag/Last-Modified revalidation
+
+# --- Model List Cache ---
+MODELS_CACHE_TTL = 60 * 60 # Seconds a fetched model list is served without refreshing
+MODELS_CACHE_STALE_TTL = 24 * 60 * 60 # Up to this age a stale list is served while it refreshes in the background
+# Shared across worker processes and restarts; set MODELS_CACHE_FILE to an empty string to disable
+MODELS_CACHE_FILE = os.getenv("MODELS_CACHE_FILE", os.path.join(os.path.expanduser("~"), ".cache", "aichatbot", "models.json")) or None
+
+# --- Summaries ---
+MAX_PROMPT_CHARS = 400_000 # Cap on gathered context sent to the model for a summary
 
 # --- Database ---
 DB_NAME = 'chat_history.db'
 
 # --- Application Settings ---
-DEBUG_MODE = True # Set to False in production
+DEBUG_MODE = os.getenv("FLASK_DEBUG") == "1" # Opt in with FLASK_DEBUG=1; never enable on a reachable host
 HOST = '0.0.0.0'
 PORT = 5000
 
@@ -1,6 +1,13 @@
 import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import lxml.html
+import charset_normalizer # Encoding detection for fetched pages (installed with requests)
 import html
 import config # Import the config module directly
 # Remove direct imports of constants that need to be monkeypatched
@@ -15,6 +22,81 @@ from config import (
 
 # --- URL Fetching and Processing ---
 
+# Shared session so repeated fetches (e.g. several links from one site) reuse pooled keep-alive
+# connections instead of a new TCP+TLS handshake per URL. The pool holds one connection per
+# concurrent fetch worker; only connection failures are retried, never a slow read.
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.headers.update({ # Mimic a browser to avoid simple blocks
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+})
+_HTTP_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=config.MAX_URL_FETCH_WORKERS,
+    max_retries=Retry(total=2, read=0, status=0, backoff_factor=0.3)
+)
+HTTP_SESSION.mount('http://', _HTTP_ADAPTER)
+HTTP_SESSION.mount('https://', _HTTP_ADAPTER)
+
+# Extracted text of recently fetched URLs that sent an ETag or Last-Modified validator,
+# keyed by URL: {url: (etag, last_modified, context_str, processed_url_info)}.
+# Later fetches revalidate with a conditional GET; a 304 reuses the entry with no body download or parse.
+_URL_CACHE = OrderedDict()
+_URL_CACHE_LOCK = threading.Lock() # fetch_and_process_urls calls in from worker threads
+
+def decode_url_content(content, response):
+    """
+    Decodes fetched URL bytes in a single pass: the charset declared in the Content-Type header
+    if any, else UTF-8, else the encoding charset_normalizer detects (e.g. windows-1252 pages).
+    """
+    content_type = response.headers.get('content-type', '')
+    if 'charset=' in content_type.lower():
+        declared = requests.utils.get_encoding_from_headers(response.headers)
+        try:
+            return content.decode(declared, errors='replace')
+        except LookupError: # Unknown charset name in the header
+            pass
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        best = charset_normalizer.from_bytes(content).best()
+        return str(best) if best is not None else content.decode('utf-8', errors='replace')
+
+def extract_html_text(html_content):
+    """
+    Returns the visible text of an HTML document: script and style contents removed,
+    each text node stripped and joined with single spaces.
+    Parses with lxml (libxml2, C), falling back to BeautifulSoup if lxml can't handle the input.
+    """
+    try:
+        doc = lxml.html.document_fromstring(html_content)
+        for script_or_style in doc.xpath('//script|//style'):
+            script_or_style.drop_tree() # Keeps the tail text that follows the element
+        return ' '.join(s for s in (t.strip() for t in doc.itertext()) if s)
+    except Exception as e:
+        print(f"lxml could not parse HTML ({e}), falling back to BeautifulSoup.")
+    from bs4 import BeautifulSoup # Imported on first fallback only; bs4 adds ~50 ms to startup otherwise
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Remove script and style elements which don't usually contain useful context
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    # Get text, strip leading/trailing whitespace from each string, join with spaces
+    return ' '.join(soup.stripped_strings)
+
+def cache_url_result(url, response, context_str, processed_url_info):
+    """
+    Remembers a successful extraction if the server sent a validator to revalidate it with.
+    Evicts the least recently used entry beyond config.URL_CACHE_MAX_ENTRIES.
+    """
+    etag = response.headers.get('etag')
+    last_modified = response.headers.get('last-modified')
+    if not (etag or last_modified):
+        return
+    with _URL_CACHE_LOCK:
+        _URL_CACHE[url] = (etag, last_modified, context_str, dict(processed_url_info))
+        _URL_CACHE.move_to_end(url)
+        while len(_URL_CACHE) > config.URL_CACHE_MAX_ENTRIES:
+            _URL_CACHE.popitem(last=False)
+
 def fetch_and_process_url(url):
     """
     Fetches content from a URL, extracts text, and handles errors.
@@ -29,63 +111,65 @@ def fetch_and_process_url(url):
         "message": None,
         "context_added": False
     }
+    response = None
 
     try:
-        headers = { # Mimic a browser to avoid simple blocks
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        headers = {} # Per-request additions to HTTP_SESSION's headers
+        with _URL_CACHE_LOCK:
+            cached = _URL_CACHE.get(url)
+        if cached:
+            etag, last_modified = cached[0], cached[1]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
         # Use stream=True to handle large responses and check headers first
-        response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
+        response = HTTP_SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT, stream=True)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
 
+        if cached and response.status_code == 304: # Not Modified: reuse the cached extraction
+            with _URL_CACHE_LOCK:
+                if url in _URL_CACHE:
+                    _URL_CACHE.move_to_end(url)
+            return cached[2], None, dict(cached[3])
+
         content_type = response.headers.get('content-type', '').lower()
 
         # Basic check for HTML/Text content before downloading fully
         if 'html' in content_type or 'text' in content_type:
-            content = b""
-            bytes_read = 0
-            for chunk in response.iter_content(chunk_size=8192):
-                content += chunk
-                bytes_read += len(chunk)
-                if bytes_read > config.MAX_URL_CONTENT_BYTES: # Use config.MAX_URL_CONTENT_BYTES
+            content = bytearray() # Grows in place; bytes += chunk would copy the whole buffer every chunk
+            for chunk in response.iter_content(chunk_size=config.URL_READ_CHUNK_BYTES):
+                content.extend(chunk)
+                if len(content) > config.MAX_URL_CONTENT_BYTES: # Use config.MAX_URL_CONTENT_BYTES
+                    del content[config.MAX_URL_CONTENT_BYTES:] # Hard cap: never hold more than the limit
                     error_msg = f"Error: URL content exceeds limit ({config.MAX_URL_CONTENT_BYTES / (1024*1024):.1f} MB). Truncated." # Use config.MAX_URL_CONTENT_BYTES
                     processed_url_info["message"] = error_msg
                     break # Stop reading
 
-            # Decode content (attempt common encodings)
-            try:
-                decoded_content = content.decode('utf-8')
-            except UnicodeDecodeError:
-                try:
-                    decoded_content = content.decode('iso-8859-1')
-                except UnicodeDecodeError:
-                    # Fallback, ignoring errors might lose some characters
-                    decoded_content = content.decode('ascii', errors='ignore')
-
-            # Extract text using BeautifulSoup for HTML
+            decoded_content = decode_url_content(content, response)
+
+            # Extract text from HTML
             if 'html' in content_type:
-                soup = BeautifulSoup(decoded_content, 'html.parser')
-                # Remove script and style elements which don't usually contain useful context
-                for script_or_style in soup(["script", "style"]):
-                    script_or_style.decompose()
-                # Get text, strip leading/trailing whitespace from each string, join with spaces
-                text = ' '.join(soup.stripped_strings)
+                text = extract_html_text(decoded_content)
             else: # Plain text
                 text = decoded_content.strip() # Strip whitespace from plain text
 
-            # Add context header/footer
-            context_str += f"--- START CONTEXT FROM URL: {url} ---\n"
-            # Ensure final text doesn't exceed limit again after potential BS4 processing
-            context_str += text[:config.MAX_URL_CONTENT_BYTES] # Use config.MAX_URL_CONTENT_BYTES
-            if error_msg: # Append truncation warning if it occurred
-                 context_str += "\n... (Content Truncated)"
-            context_str += f"\n--- END CONTEXT FROM URL: {url} ---\n\n"
+            # Add context header/footer. No second cap on text: it was decoded from at most
+            # MAX_URL_CONTENT_BYTES bytes, and decoding/extraction never yields more characters than bytes.
+            context_str = "".join([
+                f"--- START CONTEXT FROM URL: {url} ---\n",
+                text,
+                "\n... (Content Truncated)" if error_msg else "", # Append truncation warning if it occurred
+                f"\n--- END CONTEXT FROM URL: {url} ---\n\n",
+            ])
 
             processed_url_info["status"] = "ok"
             processed_url_info["context_added"] = True
             # Keep the truncation message if it occurred
             if error_msg:
                  processed_url_info["message"] = error_msg
+            else:
+                cache_url_result(url, response, context_str, processed_url_info)
 
         else:
             error_msg = f"Error: Unsupported content type '{content_type}' for URL: {url}. Only HTML/Text supported."
@@ -102,6 +186,9 @@ def fetch_and_process_url(url):
         # Catch potential errors during content processing (decoding, BS4)
         error_msg = f"Error processing URL {url}: {e}"
         processed_url_info["message"] = error_msg
+    finally:
+        if response is not None:
+            response.close() # Release the connection even when the body wasn't read to the end
 
     # Ensure context_str is empty if a significant error occurred
     if error_msg and processed_url_info["status"] == "error":
@@ -112,8 +199,45 @@ def fetch_and_process_url(url):
     return context_str, error_msg, processed_url_info
 
 
+def fetch_and_process_urls(urls):
+    """
+    Fetches several URLs concurrently with fetch_and_process_url, at most
+    config.MAX_URL_FETCH_WORKERS at a time. Returns a list of
+    (context_str, error_msg, processed_url_info) tuples in the same order as urls.
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    if len(urls) == 1: # No point spinning up a pool for a single fetch
+        return [fetch_and_process_url(urls[0])]
+    with ThreadPoolExecutor(max_workers=min(config.MAX_URL_FETCH_WORKERS, len(urls))) as executor:
+        return list(executor.map(fetch_and_process_url, urls))
+
+
 # --- File/Folder Path Processing ---
 
+_IS_WINDOWS = os.name == 'nt' # Path comparisons are case-insensitive on Windows
+
+@lru_cache(maxsize=8)
+def resolve_allowed_dir(allowed_dir):
+    """
+    Returns os.path.realpath(allowed_dir), resolved once per configured directory.
+    Call as resolve_allowed_dir(config.ALLOWED_CONTEXT_DIR) so a reconfigured directory gets its own entry.
+    """
+    return os.path.realpath(allowed_dir)
+
+def is_within_dir(path, base_dir):
+    """
+    True if the resolved path is base_dir itself or inside it. Compares whole path
+    components via os.path.commonpath, so '/allowed-other' is not inside '/allowed'.
+    """
+    if _IS_WINDOWS:
+        path, base_dir = os.path.normcase(path), os.path.normcase(base_dir)
+    try:
+        return os.path.commonpath([path, base_dir]) == base_dir
+    except ValueError: # Different drives, or a mix of absolute and relative paths
+        return False
+
 def process_context_path(path):
     """
     Reads content from a file or lists contents of a folder within the ALLOWED_CONTEXT_DIR.
@@ -168,20 +292,11 @@ def process_context_path(path):
 
 
     # Security Check 2: Ensure the resolved path is *still* within the allowed directory
-    # This comparison must be case-insensitive on Windows
-    allowed_dir_real = os.path.realpath(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
-    if os.name == 'nt': # Windows
-        if not target_path.lower().startswith(allowed_dir_real.lower() + os.path.sep) and \
-           target_path.lower() != allowed_dir_real.lower():
-            error_msg = f"Error: Access denied. Path '{path}' resolves outside the allowed directory '{config.ALLOWED_CONTEXT_DIR_NAME}'." # Use config.ALLOWED_CONTEXT_DIR_NAME
-            processed_path_info["message"] = error_msg
-            return context_str, error_msg, processed_path_info
-    else: # Linux/macOS (case-sensitive paths)
-        if not target_path.startswith(allowed_dir_real + os.path.sep) and \
-           target_path != allowed_dir_real:
-            error_msg = f"Error: Access denied. Path '{path}' resolves outside the allowed directory '{config.ALLOWED_CONTEXT_DIR_NAME}'." # Use config.ALLOWED_CONTEXT_DIR_NAME
-            processed_path_info["message"] = error_msg
-            return context_str, error_msg, processed_path_info
+    allowed_dir_real = resolve_allowed_dir(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
+    if not is_within_dir(target_path, allowed_dir_real):
+        error_msg = f"Error: Access denied. Path '{path}' resolves outside the allowed directory '{config.ALLOWED_CONTEXT_DIR_NAME}'." # Use config.ALLOWED_CONTEXT_DIR_NAME
+        processed_path_info["message"] = error_msg
+        return context_str, error_msg, processed_path_info
 
 
     # Check if the resolved path actually exists
@@ -208,59 +323,67 @@ def process_context_path(path):
                  # Return empty context but no error_msg that halts processing other items
                  return "", error_msg, processed_path_info
 
-            context_str += f"--- START CONTEXT FROM FILE: {relative_display_path} ---\n"
             try:
-                # Read with UTF-8, ignore errors for robustness against encoding issues
-                with open(target_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    context_str += f.read(config.MAX_FILE_READ_BYTES) # Use config.MAX_FILE_READ_BYTES
+                # Read the bounded bytes in one call and decode once (UTF-8, ignoring errors for
+                # robustness against encoding issues) rather than through a text-mode wrapper
+                with open(target_path, 'rb') as f:
+                    file_text = f.read(config.MAX_FILE_READ_BYTES).decode('utf-8', errors='ignore') # Use config.MAX_FILE_READ_BYTES
+                if '\r' in file_text: # Match text mode's universal newlines
+                    file_text = file_text.replace('\r\n', '\n').replace('\r', '\n')
             except Exception as e:
                  error_msg = f"Error reading file '{relative_display_path}': {e}"
                  processed_path_info["message"] = error_msg
                  return "", error_msg, processed_path_info # Return empty context on read error
-            context_str += f"\n--- END CONTEXT FROM FILE: {relative_display_path} ---\n\n"
+            context_str = "".join([
+                f"--- START CONTEXT FROM FILE: {relative_display_path} ---\n",
+                file_text,
+                f"\n--- END CONTEXT FROM FILE: {relative_display_path} ---\n\n",
+            ])
             processed_path_info["status"] = "ok"
             processed_path_info["context_added"] = True
 
         elif os.path.isdir(target_path):
             context_str += f"--- START CONTEXT FROM FOLDER CONTENTS: {relative_display_path}/ ---\n"
             try:
-                items = os.listdir(target_path)
+                # scandir's DirEntry answers is_file/is_dir/is_symlink from the directory read
+                # and caches stat(), instead of a separate stat syscall per os.path check
+                with os.scandir(target_path) as it:
+                    entries = sorted(it, key=lambda entry: entry.name) # List items predictably
                 folder_had_items = False
-                if not items:
+                if not entries:
                     context_str += "(Folder is empty)\n"
                 else:
                     folder_had_items = True
                     # Limit the number of files listed for performance/context size
                     MAX_FILES_IN_DIR_LISTING = 50
                     count = 0
-                    items.sort() # List items predictably
-                    for item in items:
+                    for entry in entries:
                         if count >= MAX_FILES_IN_DIR_LISTING:
                             context_str += f"... (truncated listing at {MAX_FILES_IN_DIR_LISTING} items)\n"
                             break
 
-                        item_full_path = os.path.join(target_path, item)
-                        item_rel_path = os.path.join(relative_display_path, item).replace(os.path.sep, '/')
+                        item_full_path = entry.path
+                        item_rel_path = os.path.join(relative_display_path, entry.name).replace(os.path.sep, '/')
+                        is_symlink = entry.is_symlink()
 
-                        # Basic check if item exists (might have been deleted between listdir and check)
-                        if not os.path.exists(item_full_path):
+                        # Basic check if item exists (a dangling symlink, or deleted since the scan)
+                        if is_symlink and not os.path.exists(item_full_path):
                             context_str += f"--- SKIPPING ITEM (not found): {item_rel_path} ---\n"
                             continue
 
                         # Security check: Ensure listed item is still within allowed dir (paranoid check)
-                        item_real_path = os.path.realpath(item_full_path)
-                        if os.name == 'nt':
-                            if not item_real_path.lower().startswith(allowed_dir_real.lower() + os.path.sep):
-                                context_str += f"--- SKIPPING ITEM (outside allowed dir): {item_rel_path} ---\n"
-                                continue
+                        # target_path is already resolved, so only a symlinked item can point elsewhere
+                        if is_symlink:
+                            item_real_path = os.path.realpath(item_full_path)
                         else:
-                            if not item_real_path.startswith(allowed_dir_real + os.path.sep):
-                                context_str += f"--- SKIPPING ITEM (outside allowed dir): {item_rel_path} ---\n"
-                                continue
+                            item_real_path = item_full_path
+                        if item_real_path == allowed_dir_real or not is_within_dir(item_real_path, allowed_dir_real):
+                            context_str += f"--- SKIPPING ITEM (outside allowed dir): {item_rel_path} ---\n"
+                            continue
 
-                        if os.path.isfile(item_full_path):
+                        if entry.is_file():
                             try:
-                                file_size = os.path.getsize(item_full_path)
+                                file_size = entry.stat().st_size
                                 size_kb = file_size / 1024
                                 if file_size > config.MAX_FILE_READ_BYTES: # Use config.MAX_FILE_READ_BYTES
                                     context_str += f"- {item_rel_path} [File] (SKIPPED - Too large: {size_kb / 1024:.2f} MB)\n"
@@ -269,7 +392,7 @@ def process_context_path(path):
                                     count += 1
                             except Exception as e:
                                 context_str += f"- {item_rel_path} [File] (ERROR accessing: {e})\n"
-                        elif os.path.isdir(item_full_path):
+                        elif entry.is_dir():
                             context_str += f"- {item_rel_path}/ [DIR]\n"
                             count += 1
                         # else: ignore other types like symlinks, etc. in listing
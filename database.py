@@ -1,9 +1,19 @@
 import sqlite3
 import json
-import html
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 import config # Import config module directly
 
+# Statements used on every request. Each thread reuses one connection (see get_db), and sqlite3 keeps a
+# per-connection cache of prepared statements keyed by SQL text, so these are parsed and planned
+# once per thread rather than on every call.
+SQL_INSERT_HISTORY = "INSERT INTO history (user_message, bot_response, context_info) VALUES (?, ?, ?)"
+SQL_SELECT_HISTORY = "SELECT user_message, bot_response, timestamp FROM history ORDER BY timestamp ASC"
+SQL_SELECT_HISTORY_FOR_DAY = "SELECT user_message, bot_response, timestamp FROM history WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp ASC"
+SQL_SELECT_CHAT_DATES = "SELECT DISTINCT date_only as chat_date FROM history ORDER BY chat_date DESC"
+SQL_DELETE_HISTORY_FOR_DAY = "DELETE FROM history WHERE timestamp >= ? AND timestamp < ?"
+SQL_STATEMENT_CACHE_SIZE = 128 # sqlite3's default, stated explicitly since the per-thread reuse relies on it
+
 def init_db():
     """Initializes the database and creates the history table if it doesn't exist."""
     conn = None
@@ -20,7 +30,24 @@ def init_db():
                 context_info TEXT NULL -- Store JSON string of context details
             )
         ''')
+        # Day of each message ('YYYY-MM-DD'), derived by SQLite so queries can name and index it instead
+        # of calling DATE(timestamp) per row. ALTER TABLE can only add VIRTUAL generated columns, which
+        # still index normally; added here so existing databases pick it up too.
+        cursor.execute("PRAGMA table_xinfo(history)")
+        if 'date_only' not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE history ADD COLUMN date_only TEXT GENERATED ALWAYS AS (substr(timestamp, 1, 10)) VIRTUAL")
+        # Date-filtered reads and deletes compare timestamp against a day's bounds, and the date
+        # list reads date_only; both can be answered from these indexes without a table scan.
+        # app.py's init_db runs against the same file and must create exactly the same indexes.
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_ts ON history(timestamp DESC)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_date_only ON history(date_only)")
+        # Superseded: the DATE(timestamp) expression index and an ascending duplicate of idx_history_ts
+        cursor.execute("DROP INDEX IF EXISTS idx_history_date")
+        cursor.execute("DROP INDEX IF EXISTS idx_history_timestamp")
         conn.commit()
+        # WAL is a property of the database file, so setting it once here covers every later connection.
+        # Readers no longer block the writer, and commits append to the log instead of rewriting pages.
+        cursor.execute("PRAGMA journal_mode=WAL")
 
         # Verify table creation
         cursor.execute("PRAGMA table_info(history)")
@@ -40,12 +67,29 @@ def init_db():
         if conn:
             conn.close()
 
+# One connection per thread, reused across calls (sqlite3 connections can't be shared between threads by default)
+_local = threading.local()
+
 def get_db():
-    """Establishes a connection to the database."""
+    """
+    Returns this thread's database connection, opening it on first use.
+    Callers must not close it; a new one is opened if config.DB_NAME changes.
+    """
     db_name_to_use = config.DB_NAME # Access dynamically
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        if _local.db_name == db_name_to_use:
+            return conn
+        conn.close() # DB_NAME changed (e.g. a test's temporary database); drop the stale connection
+        _local.conn = None
     try:
-        conn = sqlite3.connect(db_name_to_use)
+        conn = sqlite3.connect(db_name_to_use, cached_statements=SQL_STATEMENT_CACHE_SIZE)
         conn.row_factory = sqlite3.Row # Return rows as dict-like objects
+        # Per-connection setting: with WAL, NORMAL only syncs at checkpoints instead of on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY") # Sorts/temp b-trees (e.g. DISTINCT, ORDER BY) stay off disk
+        _local.conn = conn
+        _local.db_name = db_name_to_use
         return conn
     except sqlite3.Error as e:
         print(f"Database connection error: {e} (DB: {db_name_to_use})")
@@ -61,7 +105,7 @@ def save_chat_history(user_message, bot_response, context_info_list=None):
     try:
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO history (user_message, bot_response, context_info) VALUES (?, ?, ?)",
+            SQL_INSERT_HISTORY,
             (user_message, bot_response, context_info_json)
         )
         conn.commit()
@@ -71,47 +115,90 @@ def save_chat_history(user_message, bot_response, context_info_list=None):
         return True
     except sqlite3.Error as e:
         print(f"Database error saving chat history: {e}")
+        conn.rollback() # The connection is reused, so don't leave a failed transaction open
         return False
-    finally:
-        conn.close()
 
-def get_chat_history(selected_date=None):
-    """Fetches chat history, optionally filtered by date. Returns HTML-escaped data."""
+def save_chat_history_many(rows):
+    """
+    Saves several (user_message, bot_response, context_info_list) interactions in one
+    transaction, so a burst of saves costs a single commit instead of one per row.
+    Returns True on success, False if nothing was saved.
+    """
+    params = [
+        (user_message, bot_response, json.dumps(context_info_list) if context_info_list else None)
+        for user_message, bot_response, context_info_list in rows
+    ]
+    if not params:
+        return True # Nothing to save
+
     conn = get_db()
     if not conn:
-        return [] # Return empty list if connection failed
+        return False # Cannot save if connection failed
 
-    history_list = []
     try:
-        cursor = conn.cursor()
-        if selected_date:
-            # Validate date format before querying
-            try:
-                datetime.strptime(selected_date, '%Y-%m-%d')
-                cursor.execute(
-                    "SELECT user_message, bot_response, timestamp FROM history WHERE DATE(timestamp) = ? ORDER BY timestamp ASC",
-                    (selected_date,)
-                )
-            except ValueError:
-                print(f"Invalid date format provided: {selected_date}. Fetching all history.")
-                cursor.execute("SELECT user_message, bot_response, timestamp FROM history ORDER BY timestamp ASC")
-        else:
-            cursor.execute("SELECT user_message, bot_response, timestamp FROM history ORDER BY timestamp ASC")
-
-        rows = cursor.fetchall()
-        for row in rows:
-            # HTML escape the data before returning
-            history_list.append({
-                'user_message': html.escape(row['user_message']),
-                'bot_response': html.escape(row['bot_response']),
-                'timestamp': row['timestamp']
-            })
-        return history_list
+        with conn: # Commits once on success, rolls the whole batch back on error
+            conn.executemany(
+                SQL_INSERT_HISTORY,
+                params
+            )
+        from flask import current_app
+        if not current_app or not current_app.config.get('TESTING'):
+            print(f"Saved {len(params)} interactions to DB in one transaction.")
+        return True
+    except sqlite3.Error as e:
+        print(f"Database error saving chat history batch: {e}")
+        return False
+
+HISTORY_FETCH_BATCH = 256 # Rows pulled from SQLite per fetchmany() call
+
+def iter_chat_history(selected_date=None):
+    """
+    Yields chat history dicts, optionally filtered by date, fetching rows from SQLite in batches
+    so the whole history is never held as a list of rows. Returns the stored (unescaped) text.
+    Raises sqlite3.Error on database errors; get_chat_history is the error-swallowing wrapper.
+    """
+    conn = get_db()
+    if not conn:
+        return # Nothing to yield if connection failed
+
+    cursor = conn.cursor()
+    if selected_date:
+        # Validate date format before querying
+        try:
+            start, end = day_bounds(selected_date)
+            # Range on the raw column (not DATE(timestamp)) so idx_history_ts serves filter and order
+            cursor.execute(
+                SQL_SELECT_HISTORY_FOR_DAY,
+                (start, end)
+            )
+        except ValueError:
+            print(f"Invalid date format provided: {selected_date}. Fetching all history.")
+            cursor.execute(SQL_SELECT_HISTORY)
+    else:
+        cursor.execute(SQL_SELECT_HISTORY)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(HISTORY_FETCH_BATCH)
+            if not rows:
+                break
+            for row in rows:
+                # Raw text: the template autoescapes on render, and /fetch_history escapes for its JSON consumers
+                yield {
+                    'user_message': row['user_message'],
+                    'bot_response': row['bot_response'],
+                    'timestamp': row['timestamp']
+                }
+    finally:
+        cursor.close() # Finalize the statement even if the caller stops iterating early
+
+def get_chat_history(selected_date=None):
+    """Fetches chat history, optionally filtered by date. Returns the stored (unescaped) text."""
+    try:
+        return list(iter_chat_history(selected_date))
     except sqlite3.Error as e:
         print(f"Database error fetching chat history: {e}")
         return [] # Return empty list on error
-    finally:
-        conn.close()
 
 def get_distinct_chat_dates():
     """Fetches distinct dates from the chat history."""
@@ -122,41 +209,49 @@ def get_distinct_chat_dates():
     dates = []
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT DATE(timestamp) as chat_date FROM history ORDER BY chat_date DESC")
+        cursor.execute(SQL_SELECT_CHAT_DATES)
         dates = [row['chat_date'] for row in cursor.fetchall()]
         return dates
     except sqlite3.Error as e:
         print(f"Database error fetching distinct dates: {e}")
         return []
-    finally:
-        conn.close()
+
+def day_bounds(date_str):
+    """
+    Returns the half-open [start, end) timestamp range covering a 'YYYY-MM-DD' date, for
+    comparing against the timestamp column directly instead of wrapping it in DATE().
+    Raises ValueError if date_str isn't a valid date.
+    """
+    start = datetime.strptime(date_str, '%Y-%m-%d')
+    end = start + timedelta(days=1)
+    return start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
 
 def delete_history_by_date(date_str):
     """Deletes chat history for a specific date. Returns the number of deleted rows."""
-    conn = get_db()
-    if not conn:
-        return 0 # Indicate failure or no deletion
-
-    # Validate date format first
+    # Validate date format first (before opening a connection that would otherwise be left open)
     try:
-        datetime.strptime(date_str, '%Y-%m-%d')
+        start, end = day_bounds(date_str)
     except ValueError:
         print(f"Invalid date format for deletion: {date_str}")
         return 0 # Return 0 as no rows will be deleted
 
+    conn = get_db()
+    if not conn:
+        return 0 # Indicate failure or no deletion
+
     deleted_count = 0
     try:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM history WHERE DATE(timestamp) = ?", (date_str,))
+        # One range-bounded DELETE in a single commit; the bounds match the whole day's timestamps
+        cursor.execute(SQL_DELETE_HISTORY_FOR_DAY, (start, end))
         conn.commit()
         deleted_count = cursor.rowcount # Get the number of deleted rows
         print(f"Deleted {deleted_count} entries for date: {date_str}")
         return deleted_count
     except sqlite3.Error as e:
         print(f"Database error deleting history for {date_str}: {e}")
+        conn.rollback() # The connection is reused, so don't leave a failed transaction open
         return 0 # Return 0 on error
-    finally:
-        conn.close()
 
 # Initialize the database when this module is imported (or run)
 # init_db() # Consider calling this explicitly in app setup instead
@@ -2,13 +2,39 @@ from google import genai
 from google.genai import models, types
 from typing import Optional
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from config import GOOGLE_API_KEY, DEFAULT_MODEL_NAME
+import os
+import queue
+import tempfile
+import threading
+import time
+from config import (
+    GOOGLE_API_KEY, DEFAULT_MODEL_NAME,
+    MODELS_CACHE_TTL, MODELS_CACHE_STALE_TTL, MODELS_CACHE_FILE
+)
 
 # Global variable to cache fetched models
 FETCHED_MODELS_CACHE = []
+FETCHED_MODELS_AT = 0.0 # time.time() of the fetch that produced FETCHED_MODELS_CACHE
+_MODELS_REFRESH_LOCK = threading.Lock() # Held while a background refresh is running
+# Set view of FETCHED_MODELS_CACHE for O(1) validation, rebuilt whenever the list object changes
+FETCHED_MODELS_SET = frozenset()
+_FETCHED_MODELS_SET_SOURCE = None
 client: genai.Client = None
 
+# Keep-alive session for direct REST calls (the models-list fallback), so a refresh reuses
+# the pooled connection to generativelanguage.googleapis.com instead of a new TLS handshake
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
+MODELS_API_TIMEOUT = (3.05, 10) # (connect, read) seconds
+
+# Streamed text arriving in quick succession is sent as one SSE event: buffered text is flushed once it
+# reaches SSE_COALESCE_MAX_CHARS, and never held longer than SSE_COALESCE_INTERVAL seconds after the last event
+SSE_COALESCE_MAX_CHARS = 256
+SSE_COALESCE_INTERVAL = 0.015
+_STREAM_DONE = object() # Queued by _pump_stream after the last chunk
+
 def configure_client():
     """Configures the Google Generative AI SDK with the API key."""
     global client
@@ -26,23 +52,86 @@ def configure_client():
         print(f"Error configuring Gemini client: {e}")
         return False
 
+def load_models_cache_file():
+    """
+    Loads a model list saved by another worker or an earlier run from MODELS_CACHE_FILE.
+    Returns (models_list, fetched_at), or (None, 0.0) if there is no usable file.
+    """
+    if not MODELS_CACHE_FILE:
+        return None, 0.0
+    try:
+        with open(MODELS_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        models_list = data.get('models')
+        if models_list and all(isinstance(m, str) for m in models_list):
+            return models_list, float(data.get('fetched_at', 0.0))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, AttributeError, TypeError) as e:
+        print(f"Ignoring unreadable model cache file '{MODELS_CACHE_FILE}': {e}")
+    return None, 0.0
+
+def save_models_cache_file(models_list, fetched_at):
+    """Writes the model list to MODELS_CACHE_FILE atomically (temp file + os.replace)."""
+    if not MODELS_CACHE_FILE:
+        return
+    try:
+        cache_dir = os.path.dirname(MODELS_CACHE_FILE) or '.'
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.models-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"fetched_at": fetched_at, "models": models_list}, f)
+            os.replace(tmp_path, MODELS_CACHE_FILE) # Readers see the old file or the new one, never a partial write
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Could not write model cache file '{MODELS_CACHE_FILE}': {e}")
+
+def _refresh_models_in_background():
+    """Thread target: refetches the model list, then releases the refresh lock."""
+    try:
+        get_available_models(force_refresh=True)
+    except Exception as e:
+        print(f"Background model list refresh failed: {e}")
+    finally:
+        _MODELS_REFRESH_LOCK.release()
+
 def get_available_models(force_refresh=False):
     """
     Fetches available models from the Google Generative Language API.
-    Uses a cache unless force_refresh is True.
+    Uses a cache unless force_refresh is True: fresh for MODELS_CACHE_TTL seconds, then served
+    stale (while one background thread refetches) until MODELS_CACHE_STALE_TTL. The cache is
+    also persisted to MODELS_CACHE_FILE so other workers and restarts can skip the first fetch.
     Returns a list of model names (e.g., 'gemini-1.5-flash-latest').
     """
-    global FETCHED_MODELS_CACHE
-    if FETCHED_MODELS_CACHE and not force_refresh:
-        print("Using cached model list.")
-        return FETCHED_MODELS_CACHE
+    global FETCHED_MODELS_CACHE, FETCHED_MODELS_AT
+    if not force_refresh:
+        if not FETCHED_MODELS_CACHE:
+            cached_models, cached_at = load_models_cache_file()
+            if cached_models:
+                FETCHED_MODELS_CACHE, FETCHED_MODELS_AT = cached_models, cached_at
+        if FETCHED_MODELS_CACHE:
+            age = time.time() - FETCHED_MODELS_AT
+            if age < MODELS_CACHE_TTL:
+                print("Using cached model list.")
+                return FETCHED_MODELS_CACHE
+            if age < MODELS_CACHE_STALE_TTL:
+                # Stale-while-revalidate: answer now, refresh once in the background
+                if _MODELS_REFRESH_LOCK.acquire(blocking=False):
+                    threading.Thread(target=_refresh_models_in_background, daemon=True).start()
+                print("Using cached model list (refreshing in background).")
+                return FETCHED_MODELS_CACHE
 
     if not GOOGLE_API_KEY:
         print("Warning: Cannot fetch models, API key is missing. Returning default.")
         FETCHED_MODELS_CACHE = [DEFAULT_MODEL_NAME]
+        FETCHED_MODELS_AT = time.time()
         return FETCHED_MODELS_CACHE
 
     models_list = []
+    fetched_ok = False # Only a list actually returned by the API is persisted for other processes
     try:
         # Note: The Python SDK `genai.list_models()` might be simpler if it provides
         # the necessary filtering capabilities. Let's try the SDK first.
@@ -62,6 +151,7 @@ def get_available_models(force_refresh=False):
             models_list = [DEFAULT_MODEL_NAME]
         else:
             print(f"Fetched available models via SDK: {models_list}")
+            fetched_ok = True
             models_list = sorted(models_list) # Sort for consistency
 
     except Exception as e_sdk:
@@ -69,7 +159,7 @@ def get_available_models(force_refresh=False):
         # Fallback to direct API call if SDK fails or doesn't work as expected
         try:
             url = f"https://generativelanguage.googleapis.com/v1beta/models?key={GOOGLE_API_KEY}"
-            response = requests.get(url, timeout=10)
+            response = HTTP_SESSION.get(url, timeout=MODELS_API_TIMEOUT)
             response.raise_for_status()
             data = response.json()
 
@@ -87,6 +177,7 @@ def get_available_models(force_refresh=False):
                 models_list = [DEFAULT_MODEL_NAME]
             else:
                  print(f"Fetched available models via direct API: {models_list}")
+                 fetched_ok = True
                  models_list = sorted(models_list)
 
         except requests.exceptions.RequestException as e_api:
@@ -101,22 +192,84 @@ def get_available_models(force_refresh=False):
         models_list.insert(0, DEFAULT_MODEL_NAME) # Add default at the beginning if missing
 
     FETCHED_MODELS_CACHE = models_list
+    FETCHED_MODELS_AT = time.time()
+    if fetched_ok:
+        save_models_cache_file(models_list, FETCHED_MODELS_AT)
     return FETCHED_MODELS_CACHE
 
+def is_model_available(model_name, force_refresh=False):
+    """
+    Checks model_name against the available models (see get_available_models) with a set lookup.
+    The set is rebuilt only when the model list has been (re)fetched.
+    """
+    global FETCHED_MODELS_SET, _FETCHED_MODELS_SET_SOURCE
+    models_list = get_available_models(force_refresh=force_refresh)
+    if models_list is not _FETCHED_MODELS_SET_SOURCE:
+        FETCHED_MODELS_SET = frozenset(models_list)
+        _FETCHED_MODELS_SET_SOURCE = models_list
+    return model_name in FETCHED_MODELS_SET
+
+def _pump_stream(stream, chunks, stop):
+    """
+    Reads a Gemini response stream on its own thread, putting each chunk's text on the chunks queue,
+    then _STREAM_DONE, or the exception that ended the stream. Stops early once stop is set.
+    """
+    try:
+        for chunk in stream:
+            if stop.is_set():
+                return
+            if chunk.text:
+                chunks.put(chunk.text)
+        chunks.put(_STREAM_DONE)
+    except Exception as e:
+        chunks.put(e)
+
 def generate_response_stream(prompt, model_name=DEFAULT_MODEL_NAME):
     """
     Generates a response from the Gemini model using streaming.
     Yields JSON strings for SSE (Server-Sent Events).
+    Small chunks that arrive back to back are merged into one event (see SSE_COALESCE_MAX_CHARS).
+    The stream is read on a helper thread, so buffered text is flushed on time even while the model pauses.
     """
+    chunks = queue.Queue()
+    stop = threading.Event()
+    pending_text = [] # Text received but not sent yet
+    pending_len = 0
+    last_sent = None # time.monotonic() of the last text event; None so the first chunk goes out at once
     try:
-        for chunk in client.models.generate_content_stream(
+        stream = client.models.generate_content_stream(
             model=model_name,
             contents=prompt
-        ):
-            if chunk.text:
-                # Send chunk to client via SSE
-                data = json.dumps({"text": chunk.text})
+        )
+        threading.Thread(target=_pump_stream, args=(stream, chunks, stop), name="gemini-stream", daemon=True).start()
+
+        while True:
+            # With text buffered, wait for more only until it's due; otherwise wait for the next chunk
+            timeout = max(0.0, last_sent + SSE_COALESCE_INTERVAL - time.monotonic()) if pending_text else None
+            try:
+                item = chunks.get(timeout=timeout)
+            except queue.Empty:
+                item = None # Nothing new in time: send what's buffered
+            if item is _STREAM_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if item:
+                pending_text.append(item)
+                pending_len += len(item)
+            now = time.monotonic()
+            if pending_text and (item is None or last_sent is None or pending_len >= SSE_COALESCE_MAX_CHARS
+                                 or now - last_sent >= SSE_COALESCE_INTERVAL):
+                # Send buffered chunks to client via SSE
+                data = json.dumps({"text": "".join(pending_text)})
                 yield f"data: {data}\n\n" # SSE format
+                pending_text = []
+                pending_len = 0
+                last_sent = now
+
+        # Flush what's left before signalling the end
+        if pending_text:
+            yield f"data: {json.dumps({'text': ''.join(pending_text)})}\n\n"
 
         # Signal end of stream
         yield f"data: {json.dumps({'end_stream': True})}\n\n"
@@ -129,6 +282,8 @@ def generate_response_stream(prompt, model_name=DEFAULT_MODEL_NAME):
         # Send error to client via SSE
         error_data = json.dumps({"error": f"An error occurred during generation: {e}"})
         yield f"data: {error_data}\n\n"
+    finally:
+        stop.set() # The client went away or the stream failed; don't keep reading it
 
 def generate_summary(prompt, model_name=DEFAULT_MODEL_NAME):
     """Generates a non-streaming response, suitable for summarization."""
@@ -1,7 +1,9 @@
 import io
+import os
+from concurrent.futures import ThreadPoolExecutor
 import img2pdf
 import pytesseract
-from PyPDF2 import PdfMerger
+import pikepdf
 from PIL import Image # For image validation and OCR processing
 from io import BytesIO # For handling byte streams
 from config import ALLOWED_PDF_EXTENSIONS
@@ -53,8 +55,6 @@ def convert_images_to_pdf(image_files, ocr_enabled=False):
         try:
             # Read file into memory
             img_bytes = file.read()
-            # Reset stream position in case it's read again (though not strictly necessary here)
-            file.seek(0)
 
             if not img_bytes:
                  raise PDFConversionError(f"File is empty: {file.filename}")
@@ -62,16 +62,17 @@ def convert_images_to_pdf(image_files, ocr_enabled=False):
             # Validate image format and integrity using Pillow
             img = Image.open(BytesIO(img_bytes))
             # Check format AFTER opening
-            if img.format.lower() not in ['jpeg']: # Pillow uses 'JPEG'
+            if (img.format or '').lower() not in ['jpeg']: # Pillow uses 'JPEG'
                 raise PDFConversionError(f"Invalid image format detected in file: {file.filename}. Only JPEG allowed.")
-            img.verify() # Verify image integrity
 
-            # Re-open image after verification for further processing
             # Store PIL image object if OCR is needed, otherwise store bytes for img2pdf
             if ocr_enabled:
-                img_for_processing = Image.open(BytesIO(img_bytes))
-                processed_files_data.append(img_for_processing)
+                # Decode once here: load() fails on corrupt data like verify() would, but leaves the
+                # image usable, so the same object goes to tesseract instead of a second Image.open
+                img.load()
+                processed_files_data.append(img)
             else:
+                img.verify() # Verify image integrity (no pixel decode; img2pdf embeds the JPEG bytes as-is)
                 processed_files_data.append(img_bytes)
 
         except PDFConversionError:
@@ -89,20 +90,34 @@ def convert_images_to_pdf(image_files, ocr_enabled=False):
 
         if ocr_enabled:
             # --- OCR Path ---
-            merger = PdfMerger()
+            # QPDF-backed merge: page objects are copied natively instead of re-parsed into Python objects
+            merged_pdf = pikepdf.Pdf.new()
+            page_pdfs = [] # Each source must stay open until the merged PDF is saved
             try:
-                for i, img in enumerate(processed_files_data): # Contains PIL Images here
-                    # Create searchable PDF for each image in memory
-                    # Specify language if known, e.g., lang='eng'
-                    pdf_data = pytesseract.image_to_pdf_or_hocr(img, extension='pdf')
-                    if not pdf_data:
-                         raise PDFConversionError(f"OCR processing returned empty data for image {i+1}.")
-                    pdf_stream = BytesIO(pdf_data)
-                    merger.append(pdf_stream)
-                    print(f"Processed image {i+1} with OCR.")
+                # Each page is a separate tesseract subprocess, so pages OCR in parallel on
+                # worker threads; results are merged in the original page order
+                max_workers = min(os.cpu_count() or 1, len(processed_files_data))
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr") as executor:
+                    futures = [
+                        # Create searchable PDF for each image in memory
+                        # Specify language if known, e.g., lang='eng'
+                        executor.submit(pytesseract.image_to_pdf_or_hocr, img, extension='pdf')
+                        for img in processed_files_data # Contains PIL Images here
+                    ]
+                    try:
+                        for i, future in enumerate(futures):
+                            pdf_data = future.result()
+                            if not pdf_data:
+                                 raise PDFConversionError(f"OCR processing returned empty data for image {i+1}.")
+                            page_pdf = pikepdf.Pdf.open(BytesIO(pdf_data))
+                            page_pdfs.append(page_pdf)
+                            merged_pdf.pages.extend(page_pdf.pages)
+                            print(f"Processed image {i+1} with OCR.")
+                    finally:
+                        for future in futures:
+                            future.cancel() # After a failure, don't start OCR on pages still queued
                 # Write the merged PDF to the output stream
-                merger.write(output_pdf_stream)
-                merger.close() # Close the merger object
+                merged_pdf.save(output_pdf_stream)
             except pytesseract.TesseractNotFoundError:
                  print("TesseractNotFoundError: Tesseract is not installed or not in your PATH.")
                  # Raise a specific error for the route to handle
@@ -111,6 +126,10 @@ def convert_images_to_pdf(image_files, ocr_enabled=False):
                  # Catch other potential pytesseract errors
                  print(f"Error during OCR processing: {ocr_error}")
                  raise PDFConversionError(f"An error occurred during OCR processing: {ocr_error}")
+            finally:
+                for page_pdf in page_pdfs:
+                    page_pdf.close()
+                merged_pdf.close()
         else:
             # --- Non-OCR Path (using img2pdf) ---
             # processed_files_data contains bytes here
@@ -126,6 +145,6 @@ def convert_images_to_pdf(image_files, ocr_enabled=False):
     except TesseractNotFoundError:
         raise # Re-raise Tesseract not found error
     except Exception as e:
-        # Catch errors from img2pdf or PdfMerger
+        # Catch errors from img2pdf or pikepdf
         print(f"Error during PDF generation: {e}")
         raise PDFConversionError(f"PDF generation failed: {e}")
@@ -1,53 +1,106 @@
 import os
-from flask import Blueprint, jsonify, request, json
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, jsonify, request, json, Response
 
 # Import shared utilities and config
 import config # Import config module directly
 from config import DEFAULT_MODEL_NAME # Keep this direct import
-from context_processing import fetch_and_process_url, process_context_path
-from gemini_utils import get_available_models, generate_summary
+from context_processing import fetch_and_process_url, process_context_path, resolve_allowed_dir, is_within_dir
+from gemini_utils import get_available_models, is_model_available, generate_summary
 
 # Create Blueprint
 context_bp = Blueprint('context', __name__)
 
+# Accept types for which /list_files streams newline-delimited JSON instead of one array
+NDJSON_MIMETYPES = ['application/x-ndjson', 'application/jsonl']
+
+# Fixed instructions wrapped around the gathered context of a summary request
+SUMMARY_PROMPT_PREFIX = "Please provide a concise summary of the following context obtained from %d source(s):\n\n"
+SUMMARY_PROMPT_SUFFIX = """
+
+Focus on the main topics, key information, structure, and any potential issues or highlights.
+Keep the summary clear and well-organized."""
+
+# Replaces the middle of a context item that doesn't fit in what's left of MAX_PROMPT_CHARS
+TRUNCATION_MARKER = "\n\n... [truncated to fit the summary context limit] ...\n\n"
+
+def truncate_middle(text, max_chars):
+    """
+    Returns text cut to at most max_chars by dropping its middle, so both the start of an item
+    (headers, imports, intro) and its end (conclusions, latest log lines) reach the model.
+    """
+    if len(text) <= max_chars:
+        return text
+    keep = max_chars - len(TRUNCATION_MARKER)
+    if keep <= 0:
+        return text[:max_chars] # No room for the marker; keep the head
+    head = (keep + 1) // 2
+    return "".join((text[:head], TRUNCATION_MARKER, text[len(text) - (keep - head):]))
+
+def walk_allowed_dir(base_dir):
+    """
+    Yields (relative_path, is_dir) for everything under base_dir, depth first, with forward-slash
+    paths built from the parent's relative path (no os.path.join/relpath per entry).
+    Like os.walk, symlinked folders are yielded but not descended into, and unreadable folders are skipped.
+    """
+    pending = [("", base_dir)]
+    while pending:
+        relative_dir, dir_path = pending.pop()
+        try:
+            it = os.scandir(dir_path)
+        except OSError as e:
+            print(f"Error reading directory '{dir_path}': {e}")
+            continue
+        with it:
+            for entry in it:
+                relative_path = relative_dir + '/' + entry.name if relative_dir else entry.name
+                try:
+                    is_dir = entry.is_dir() # Cached from the directory read on most filesystems
+                except OSError:
+                    is_dir = False
+                if is_dir and not entry.is_symlink(): # Never leave the allowed dir through a link
+                    pending.append((relative_path, entry.path))
+                yield relative_path, is_dir
+
 @context_bp.route('/list_files')
 def list_files_endpoint():
-    """API endpoint to recursively list all files within ALLOWED_CONTEXT_DIR."""
+    """
+    API endpoint to recursively list all files within ALLOWED_CONTEXT_DIR.
+    Returns a sorted JSON array by default. Clients that prefer NDJSON (Accept: application/x-ndjson
+    or application/jsonl) get one JSON string per line, streamed in walk order as files are found.
+    """
     all_files = []
+    stream_ndjson = request.accept_mimetypes.best_match(
+        ['application/json'] + NDJSON_MIMETYPES, default='application/json') in NDJSON_MIMETYPES
     if not config.ALLOWED_CONTEXT_DIR or not os.path.exists(config.ALLOWED_CONTEXT_DIR): # Use config.ALLOWED_CONTEXT_DIR
         print(f"Warning: ALLOWED_CONTEXT_DIR ('{config.ALLOWED_CONTEXT_DIR}') not found for listing files.") # Use config.ALLOWED_CONTEXT_DIR
+        if stream_ndjson:
+            return Response('', mimetype='application/x-ndjson')
         return jsonify([]) # Return empty list if dir doesn't exist
 
     try:
-        allowed_dir_real = os.path.realpath(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
-        for root, dirs, files in os.walk(allowed_dir_real):
-            # Security check: Ensure we don't somehow walk outside the allowed dir
-            current_root_real = os.path.realpath(root)
-            if os.name == 'nt': # Windows case-insensitive check
-                 if not current_root_real.lower().startswith(allowed_dir_real.lower()):
-                     print(f"Warning: Skipping directory outside allowed root: {current_root_real}")
-                     continue
-            else: # Case-sensitive check
-                 if not current_root_real.startswith(allowed_dir_real):
-                     print(f"Warning: Skipping directory outside allowed root: {current_root_real}")
-                     continue
-
-            for filename in files:
+        allowed_dir_real = resolve_allowed_dir(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
+        # The walk doesn't follow symlinked folders, so starting from the resolved directory
+        # everything it yields is inside it; no per-entry realpath check
+        files = (relative_path for relative_path, is_dir in walk_allowed_dir(allowed_dir_real) if not is_dir)
+
+        if stream_ndjson:
+            def generate():
                 try:
-                    full_path = os.path.join(root, filename)
-                    # Calculate path relative to the *original* ALLOWED_CONTEXT_DIR for consistency
-                    relative_path = os.path.relpath(full_path, allowed_dir_real)
-                    # Use forward slashes for display consistency across OS
-                    all_files.append(relative_path.replace(os.path.sep, '/'))
-                except Exception as item_e:
-                     print(f"Error processing file item '{filename}' in '{root}': {item_e}")
-                     # Optionally skip this file and continue
+                    for relative_path in files:
+                        yield json.dumps(relative_path) + '\n'
+                except Exception as e:
+                    # Headers are already sent, so the listing just ends early
+                    print(f"Error listing files in '{allowed_dir_real}': {e}")
+            return Response(generate(), mimetype='application/x-ndjson')
+
+        all_files = sorted(files)
 
     except Exception as e:
         print(f"Error listing files in '{config.ALLOWED_CONTEXT_DIR}': {e}") # Use config.ALLOWED_CONTEXT_DIR
         return jsonify({"error": f"Failed to list files: {e}"}), 500
 
-    return jsonify(sorted(all_files))
+    return jsonify(all_files)
 
 @context_bp.route('/list_folders')
 def list_folders_endpoint():
@@ -58,27 +111,10 @@ def list_folders_endpoint():
         return jsonify([])
 
     try:
-        allowed_dir_real = os.path.realpath(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
-        for root, dirs, files in os.walk(allowed_dir_real):
-            # Security check (similar to list_files)
-            current_root_real = os.path.realpath(root)
-            if os.name == 'nt':
-                 if not current_root_real.lower().startswith(allowed_dir_real.lower()):
-                     print(f"Warning: Skipping directory outside allowed root: {current_root_real}")
-                     continue
-            else:
-                 if not current_root_real.startswith(allowed_dir_real):
-                     print(f"Warning: Skipping directory outside allowed root: {current_root_real}")
-                     continue
-
-            for dirname in dirs:
-                try:
-                    full_path = os.path.join(root, dirname)
-                    relative_path = os.path.relpath(full_path, allowed_dir_real)
-                    # Use forward slashes and add trailing slash for display
-                    all_folders.append(relative_path.replace(os.path.sep, '/') + '/')
-                except Exception as item_e:
-                     print(f"Error processing directory item '{dirname}' in '{root}': {item_e}")
+        allowed_dir_real = resolve_allowed_dir(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
+        # Like list_files, the walk can't leave the resolved directory (symlinked folders aren't followed)
+        # Add trailing slash for display
+        all_folders = [relative_path + '/' for relative_path, is_dir in walk_allowed_dir(allowed_dir_real) if is_dir]
 
     except Exception as e:
         print(f"Error listing folders in '{config.ALLOWED_CONTEXT_DIR}': {e}") # Use config.ALLOWED_CONTEXT_DIR
@@ -124,18 +160,13 @@ def suggest_path_endpoint():
             search_dir_relative = "" # Search in the root
 
         # Resolve the actual search directory path securely
-        allowed_dir_real = os.path.realpath(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
+        allowed_dir_real = resolve_allowed_dir(config.ALLOWED_CONTEXT_DIR) # Use config.ALLOWED_CONTEXT_DIR
         search_dir_absolute = os.path.realpath(os.path.join(allowed_dir_real, search_dir_relative))
 
         # Security Check: Ensure the search directory is still within the allowed directory
-        if os.name == 'nt':
-             if not search_dir_absolute.lower().startswith(allowed_dir_real.lower()):
-                 print(f"Warning: Suggestion path '{search_dir_absolute}' resolved outside allowed directory.")
-                 return jsonify([])
-        else:
-             if not search_dir_absolute.startswith(allowed_dir_real):
-                 print(f"Warning: Suggestion path '{search_dir_absolute}' resolved outside allowed directory.")
-                 return jsonify([])
+        if not is_within_dir(search_dir_absolute, allowed_dir_real):
+            print(f"Warning: Suggestion path '{search_dir_absolute}' resolved outside allowed directory.")
+            return jsonify([])
 
         if not os.path.isdir(search_dir_absolute):
             return jsonify([]) # Base directory doesn't exist or isn't a directory
@@ -185,41 +216,69 @@ def summarize_context_endpoint():
 
     # Get selected model from request or use default
     selected_model_name = data.get('model_name', DEFAULT_MODEL_NAME)
-    available_models = get_available_models() # Use cache
-    if selected_model_name not in available_models:
+    if not is_model_available(selected_model_name): # Use cache
          # Don't refresh here, just return error if invalid model was sent
+         available_models = get_available_models()
          return jsonify({"error": f"Invalid model selected for summary: {selected_model_name}. Available: {available_models}"}), 400
 
     # Process each context item and gather their content
-    full_context = ""
+    context_parts = [] # Joined once below instead of repeated string +=
+    total_chars = 0
     errors = []
     processed_paths_info_summary = [] # Separate tracking for summary context
 
-    for item in context_items:
-        context_part = ""
-        error = None
-        path_info = None
-        try:
-            if item.startswith(('http://', 'https://')):
-                context_part, error, path_info = fetch_and_process_url(item)
-            else:
-                context_part, error, path_info = process_context_path(item)
-
-            if path_info:
-                processed_paths_info_summary.append(path_info) # Log attempt
-            if error:
-                errors.append(path_info.get("message") or f"Error processing: {item}")
-            if context_part:
-                full_context += context_part
-
-        except Exception as e:
-            error_msg = f"Unexpected error processing context item '{item}' for summary: {e}"
-            print(error_msg)
-            errors.append(error_msg)
-            processed_paths_info_summary.append({
-                 "original": item, "status": "error", "message": error_msg
-            })
+    # Start all URL fetches up front so their network waits overlap; results are
+    # still consumed in the original item order below
+    url_items = [item for item in context_items if item.startswith(('http://', 'https://'))]
+    url_futures = {}
+    url_executor = None
+    if url_items:
+        url_executor = ThreadPoolExecutor(max_workers=min(config.MAX_URL_FETCH_WORKERS, len(url_items)))
+        url_futures = {item: url_executor.submit(fetch_and_process_url, item) for item in url_items}
 
+    try:
+        for item in context_items:
+            if total_chars >= config.MAX_PROMPT_CHARS:
+                # Anything past the cap would be cut from the prompt anyway, so skip the work
+                errors.append(f"Context limit of {config.MAX_PROMPT_CHARS} characters reached; skipped: {item}")
+                if item in url_futures:
+                    url_futures[item].cancel()
+                continue
+            context_part = ""
+            error = None
+            path_info = None
+            try:
+                if item.startswith(('http://', 'https://')):
+                    context_part, error, path_info = url_futures[item].result()
+                else:
+                    context_part, error, path_info = process_context_path(item)
+
+                if path_info:
+                    processed_paths_info_summary.append(path_info) # Log attempt
+                if error:
+                    errors.append(path_info.get("message") or f"Error processing: {item}")
+                if context_part:
+                    remaining = config.MAX_PROMPT_CHARS - total_chars
+                    if len(context_part) > remaining:
+                        # Keep the head and tail of the item that crosses the limit instead of sending
+                        # a prompt the model would reject or spend minutes on
+                        context_part = truncate_middle(context_part, remaining)
+                        errors.append(f"Context limit of {config.MAX_PROMPT_CHARS} characters reached; truncated: {item}")
+                    context_parts.append(context_part)
+                    total_chars += len(context_part)
+
+            except Exception as e:
+                error_msg = f"Unexpected error processing context item '{item}' for summary: {e}"
+                print(error_msg)
+                errors.append(error_msg)
+                processed_paths_info_summary.append({
+                     "original": item, "status": "error", "message": error_msg
+                })
+    finally:
+        if url_executor:
+            url_executor.shutdown(wait=False)
+
+    full_context = "".join(context_parts) # At most config.MAX_PROMPT_CHARS, see truncate_middle above
 
     if not full_context and not errors:
          # If no context could be gathered and no errors occurred (e.g., all items were empty)
@@ -231,14 +290,8 @@ def summarize_context_endpoint():
     # --- Generate Summary ---
     try:
         # Create a prompt that asks for a summary
-        # Limit the context sent to the model if it's excessively large?
-        # For now, send all gathered context. Consider truncation if needed.
-        prompt = f"""Please provide a concise summary of the following context obtained from {len(context_items)} source(s):
-
-{full_context}
-
-Focus on the main topics, key information, structure, and any potential issues or highlights.
-Keep the summary clear and well-organized."""
+        # full_context is already capped at config.MAX_PROMPT_CHARS
+        prompt = "".join((SUMMARY_PROMPT_PREFIX % len(context_items), full_context, SUMMARY_PROMPT_SUFFIX))
 
         # Use the non-streaming generation utility
         summary = generate_summary(prompt, selected_model_name)
@@ -3,6 +3,7 @@ from flask import (
     jsonify, json
 )
 from datetime import datetime
+from markupsafe import escape
 
 # Import shared utilities and config
 import config # Import the config module directly
@@ -12,8 +13,8 @@ from database import (
     get_chat_history, get_distinct_chat_dates, save_chat_history,
     delete_history_by_date
 )
-from gemini_utils import get_available_models, generate_response_stream
-from context_processing import fetch_and_process_url, process_context_path
+from gemini_utils import get_available_models, is_model_available, generate_response_stream
+from context_processing import fetch_and_process_urls, process_context_path
 
 # Create Blueprint
 main_bp = Blueprint('main', __name__, template_folder='../templates') # Point to parent templates folder
@@ -58,13 +59,12 @@ def chat_endpoint():
         return Response(json.dumps({"error": "No message or context provided."}), status=400, mimetype='application/json')
 
     # Validate selected model against the fetched list
-    available_models = get_available_models() # Use cached list
-    if selected_model_name not in available_models:
+    if not is_model_available(selected_model_name): # Use cached list
         # Attempt to refresh the list *once* if model not found
         print(f"Selected model '{selected_model_name}' not in cached list, attempting refresh...")
-        available_models = get_available_models(force_refresh=True)
-        if selected_model_name not in available_models:
+        if not is_model_available(selected_model_name, force_refresh=True):
              print(f"Error: Invalid model selected even after refresh: {selected_model_name}")
+             available_models = get_available_models()
              return Response(json.dumps({"error": f"Invalid model selected: {selected_model_name}. Available: {available_models}"}), status=400, mimetype='application/json')
 
     # --- Process Active Context Items ---
@@ -74,6 +74,10 @@ def chat_endpoint():
 
     if active_context_items:
         print(f"Processing active context: {active_context_items}")
+        # Fetch all URLs up front and concurrently so a chat with several links waits
+        # for the slowest one rather than the sum of all of them
+        url_items = [item for item in active_context_items if item.startswith(('http://', 'https://'))]
+        url_results = dict(zip(url_items, fetch_and_process_urls(url_items))) if url_items else {}
         for item_path in active_context_items:
             context_part_content = "" # Content from successful processing
             error_message_for_prompt = None # Specific error message for this item for the prompt
@@ -81,7 +85,7 @@ def chat_endpoint():
 
             try:
                 if item_path.startswith(('http://', 'https://')):
-                    context_part_content, error, path_info = fetch_and_process_url(item_path)
+                    context_part_content, error, path_info = url_results[item_path]
                 else:
                     context_part_content, error, path_info = process_context_path(item_path)
 
@@ -179,8 +183,11 @@ def fetch_history_endpoint():
     """API endpoint to fetch chat history for a specific date or all history."""
     selected_date = request.args.get('date')
     try:
-        # get_chat_history handles date validation and HTML escaping
-        history_list = get_chat_history(selected_date)
+        # get_chat_history handles date validation; escape here since the page inserts bot responses as HTML
+        history_list = [
+            {**msg, 'user_message': str(escape(msg['user_message'])), 'bot_response': str(escape(msg['bot_response']))}
+            for msg in get_chat_history(selected_date)
+        ]
         return jsonify({'history': history_list})
     except Exception as e:
         # Catch unexpected errors during fetch
@@ -10,4 +10,5 @@ if __name__ == '__main__':
     # but we can also pass them explicitly to app.run() if needed,
     # though it's generally better to rely on the config loaded by create_app.
     print(f"Starting server with debug={DEBUG_MODE}, host={HOST}, port={PORT}")
-    app.run(debug=DEBUG_MODE, host=HOST, port=PORT)
+    # Development server only; in production serve `run:app` with a WSGI server (see README)
+    app.run(debug=DEBUG_MODE, host=HOST, port=PORT, threaded=True)
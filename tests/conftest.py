@@ -4,7 +4,6 @@ import os
 import tempfile
 from unittest.mock import patch, MagicMock
 import requests # Added for mock_requests_get
-import PyPDF2 # Added for MockPdfMerger
 
 # Import database functions and config values
 from database import init_db as initialize_database
@@ -27,6 +26,8 @@ def pytest_configure(config): # Changed argument name config_pytest to config
     config_module_for_patching.GOOGLE_API_KEY = "test_api_key_from_pytest_configure"
     # Also update gemini_utils module variable as it imports from config
     gemini_utils_module_for_patching.GOOGLE_API_KEY = "test_api_key_from_pytest_configure"
+    # Keep tests from reading or writing the shared on-disk model list cache
+    gemini_utils_module_for_patching.MODELS_CACHE_FILE = None
 
 def pytest_unconfigure(config): # Changed argument name config_pytest to config
     """Restores original configuration after tests."""
@@ -160,8 +161,10 @@ def mock_gemini_client(monkeypatch):
 
 @pytest.fixture(scope='function')
 def mock_requests_get():
-    """Mocks requests.get for function scope."""
-    with patch('requests.get') as mock_get:
+    """Mocks requests.get and the shared HTTP sessions' get (context_processing, gemini_utils) for function scope."""
+    with patch('requests.get') as mock_get, \
+         patch('context_processing.HTTP_SESSION.get', new=mock_get), \
+         patch('gemini_utils.HTTP_SESSION.get', new=mock_get):
         # Now that 'requests' is imported, this spec should work.
         mock_response = MagicMock(spec=requests.Response)
         mock_response.status_code = 200
@@ -191,17 +194,6 @@ def mock_img2pdf_convert():
         mock_convert.return_value = b"pdf_bytes_from_img2pdf"
         yield mock_convert
 
-@pytest.fixture(scope='function')
-def MockPdfMerger(): # Renamed to follow pytest fixture naming conventions (lowercase start)
-    """Mocks PyPDF2.PdfMerger for function scope."""
-    # Path to where PdfMerger is imported in the module under test (pdf_utils.py)
-    with patch('pdf_utils.PdfMerger') as mock_merger_class:
-        # mock_merger_class is the mock for the PdfMerger class itself.
-        # We need to mock the instance that will be created from it.
-        mock_merger_instance = MagicMock(spec=PyPDF2.PdfMerger)
-        mock_merger_class.return_value = mock_merger_instance
-        yield mock_merger_instance # Yield the instance, as that's what the code will interact with
-
 # TODO: Still need to consider mocking for file system operations more granularly
 # for context_processing unit tests (pyfakefs or individual os module patches).
 # The temp_allowed_context_dir is good for routes.
@@ -40,6 +40,35 @@ def test_list_files_with_content(client, temp_allowed_context_dir, monkeypatch):
     ])
     assert response.json == expected_files
 
+def test_list_files_does_not_follow_symlinked_folders(client, temp_allowed_context_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
+    create_file_in_temp(temp_allowed_context_dir, "inside.txt")
+    outside_dir = tmp_path / "outside"
+    outside_dir.mkdir()
+    (outside_dir / "secret.txt").write_text("secret")
+    os.symlink(outside_dir, os.path.join(temp_allowed_context_dir, "link"))
+
+    response = client.get('/context/list_files')
+    assert response.status_code == 200
+    assert response.json == ["inside.txt"]
+
+def test_list_files_streams_ndjson_when_accepted(client, temp_allowed_context_dir, monkeypatch):
+    monkeypatch.setattr(app_config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
+    create_file_in_temp(temp_allowed_context_dir, "file1.txt")
+    os.makedirs(os.path.join(temp_allowed_context_dir, "subdir"), exist_ok=True)
+    create_file_in_temp(os.path.join(temp_allowed_context_dir, "subdir"), "file2.txt")
+
+    response = client.get('/context/list_files', headers={'Accept': 'application/x-ndjson'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert sorted(json.loads(line) for line in lines) == ["file1.txt", "subdir/file2.txt"] # Walk order, not sorted
+
+    # Browsers and plain clients still get the sorted JSON array
+    response = client.get('/context/list_files', headers={'Accept': 'application/json, */*'})
+    assert response.mimetype == 'application/json'
+    assert response.json == ["file1.txt", "subdir/file2.txt"]
+
 def test_list_files_allowed_dir_not_exist(client, monkeypatch):
     non_existent_path = "/path/to/nonexistent/dir_for_test_list_files"
     monkeypatch.setattr(app_config, 'ALLOWED_CONTEXT_DIR', non_existent_path)
@@ -76,6 +105,16 @@ def test_list_folders_with_content(client, temp_allowed_context_dir, monkeypatch
     # The route _should_ convert to forward slashes.
     assert sorted(response.json) == expected_folders
 
+def test_list_folders_lists_but_does_not_enter_symlinked_folders(client, temp_allowed_context_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(app_config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
+    outside_dir = tmp_path / "outside"
+    (outside_dir / "nested").mkdir(parents=True)
+    os.symlink(outside_dir, os.path.join(temp_allowed_context_dir, "link"))
+
+    response = client.get('/context/list_folders')
+    assert response.status_code == 200
+    assert response.json == ["./", "link/"] # Same as os.walk: the link is listed, "link/nested/" is not
+
 
 def test_list_folders_allowed_dir_not_exist(client, monkeypatch):
     non_existent_path = "/path/to/nonexistent/dir_for_test_list_folders"
@@ -173,8 +212,9 @@ def test_summarize_context_no_items(client):
     assert response.status_code == 400
     assert "Invalid or empty context items list" in response.json['error']
 
-@patch('routes.context_routes.get_available_models', return_value=[DEFAULT_MODEL_NAME]) # Mock model availability check
-def test_summarize_context_invalid_model(mock_get_avail_models, client):
+@patch('routes.context_routes.get_available_models', return_value=[DEFAULT_MODEL_NAME])
+@patch('routes.context_routes.is_model_available', return_value=False) # Mock model availability check
+def test_summarize_context_invalid_model(mock_is_model_available, mock_get_avail_models, client):
     payload = {
         "context_items": ["file.txt"], # Needs at least one item
         "model_name": "invalid-model-for-summary"
@@ -242,3 +282,62 @@ def test_summarize_context_partial_success(mock_generate_summary, mock_fetch_url
     assert "File context here." in prompt_arg
     # Error messages for failed items should not be in the prompt sent to Gemini
     assert "Error processing URL http://bad.url: Failed to fetch URL" not in prompt_arg
+
+@patch('routes.context_routes.process_context_path')
+@patch('routes.context_routes.generate_summary')
+def test_summarize_context_caps_prompt_size(mock_generate_summary, mock_process_path, client, monkeypatch):
+    monkeypatch.setattr(app_config, 'MAX_PROMPT_CHARS', 10)
+    mock_process_path.return_value = ("0123456789abcdef", None, {"status": "ok", "path_type": "file", "original": "a.txt"})
+    mock_generate_summary.return_value = "Capped summary."
+
+    payload = {"context_items": ["a.txt", "b.txt"], "model_name": DEFAULT_MODEL_NAME}
+    response = client.post('/context/summarize_context', json=payload)
+
+    assert response.status_code == 200
+    mock_process_path.assert_called_once_with("a.txt") # b.txt skipped once the cap is reached
+    prompt_arg = mock_generate_summary.call_args[0][0]
+    assert "0123456789" in prompt_arg
+    assert "abcdef" not in prompt_arg
+    assert any("b.txt" in warning for warning in response.json['warnings'])
+
+@patch('routes.context_routes.process_context_path')
+@patch('routes.context_routes.generate_summary')
+def test_summarize_context_keeps_head_and_tail_of_oversized_item(mock_generate_summary, mock_process_path, client, monkeypatch):
+    from routes.context_routes import TRUNCATION_MARKER
+    monkeypatch.setattr(app_config, 'MAX_PROMPT_CHARS', len(TRUNCATION_MARKER) + 20)
+    long_part = "HEAD" + "m" * 1000 + "TAIL"
+    mock_process_path.return_value = (long_part, None, {"status": "ok", "path_type": "file", "original": "big.txt"})
+    mock_generate_summary.return_value = "Summary."
+
+    response = client.post('/context/summarize_context', json={"context_items": ["big.txt"], "model_name": DEFAULT_MODEL_NAME})
+
+    assert response.status_code == 200
+    prompt_arg = mock_generate_summary.call_args[0][0]
+    assert ("HEAD" + "m" * 6 + TRUNCATION_MARKER + "m" * 6 + "TAIL") in prompt_arg
+    assert any("truncated: big.txt" in warning for warning in response.json['warnings'])
+
+@patch('routes.context_routes.process_context_path')
+@patch('routes.context_routes.fetch_and_process_url')
+@patch('routes.context_routes.generate_summary')
+def test_summarize_context_fetches_urls_concurrently(mock_generate_summary, mock_fetch_url, mock_process_path, client):
+    import threading
+    # Each fetch waits for the other, so this only completes if both run at the same time
+    both_started = threading.Barrier(2, timeout=5)
+
+    def slow_fetch(url):
+        both_started.wait()
+        return (f"Context from {url}.", None, {"status": "ok", "path_type": "url", "original": url})
+
+    mock_fetch_url.side_effect = slow_fetch
+    mock_process_path.return_value = ("File context.", None, {"status": "ok", "path_type": "file", "original": "f.txt"})
+    mock_generate_summary.return_value = "Summary."
+
+    payload = {"context_items": ["http://a.example", "f.txt", "http://b.example"], "model_name": DEFAULT_MODEL_NAME}
+    response = client.post('/context/summarize_context', json=payload)
+
+    assert response.status_code == 200
+    assert "warnings" not in response.json
+    # Context keeps the order the items were given in
+    assert [item['original'] for item in response.json['processed_items']] == ["http://a.example", "f.txt", "http://b.example"]
+    prompt_arg = mock_generate_summary.call_args[0][0]
+    assert prompt_arg.index("http://a.example") < prompt_arg.index("File context.") < prompt_arg.index("http://b.example")
@@ -52,13 +52,12 @@ import gemini_utils # Added for monkeypatching gemini_utils.client
 @patch('routes.main_routes.save_chat_history')
 @patch('routes.main_routes.generate_response_stream') # This is gemini_utils.generate_response_stream
 @patch('routes.main_routes.process_context_path')
-@patch('routes.main_routes.fetch_and_process_url')
-@patch('routes.main_routes.get_available_models')
-def test_chat_endpoint_basic_message(mock_get_models, mock_fetch_url, mock_process_path, mock_gen_stream, mock_save_history, client, mock_gemini_client, monkeypatch): # Added monkeypatch
+@patch('routes.main_routes.fetch_and_process_urls')
+@patch('routes.main_routes.is_model_available', return_value=True)
+def test_chat_endpoint_basic_message(mock_is_model_available, mock_fetch_url, mock_process_path, mock_gen_stream, mock_save_history, client, mock_gemini_client, monkeypatch): # Added monkeypatch
     # Ensure gemini_utils.client is the mock from the fixture
     monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client, raising=False)
 
-    mock_get_models.return_value = [DEFAULT_MODEL_NAME]
     mock_gen_stream.return_value = iter([
         f"data: {json.dumps({'text': 'Response chunk 1 '})}\n\n",
         f"data: {json.dumps({'text': 'chunk 2.'})}\n\n",
@@ -86,13 +85,12 @@ def test_chat_endpoint_basic_message(mock_get_models, mock_fetch_url, mock_proce
 @patch('routes.main_routes.save_chat_history')
 @patch('routes.main_routes.generate_response_stream')
 @patch('routes.main_routes.process_context_path')
-@patch('routes.main_routes.fetch_and_process_url') # Mock even if not used to prevent actual calls
-@patch('routes.main_routes.get_available_models')
-def test_chat_endpoint_with_file_context(mock_get_models, mock_fetch_url, mock_process_path, mock_gen_stream, mock_save_history, client, mock_gemini_client, monkeypatch): # Added mock_gemini_client, monkeypatch
+@patch('routes.main_routes.fetch_and_process_urls') # Mock even if not used to prevent actual calls
+@patch('routes.main_routes.is_model_available', return_value=True)
+def test_chat_endpoint_with_file_context(mock_is_model_available, mock_fetch_url, mock_process_path, mock_gen_stream, mock_save_history, client, mock_gemini_client, monkeypatch): # Added mock_gemini_client, monkeypatch
     # Ensure gemini_utils.client is the mock from the fixture
     monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client, raising=False)
 
-    mock_get_models.return_value = [DEFAULT_MODEL_NAME]
     file_context_info = {"original": "file.txt", "status": "ok", "path_type": "file", "actual_path": "/path/file.txt", "message": "File processed"}
     mock_process_path.return_value = ("File context. ", None, file_context_info)
     mock_gen_stream.return_value = iter([f"data: {json.dumps({'text': 'Reply.'})}\n\n", f"data: {json.dumps({'end_stream': True})}\n\n"])
@@ -114,19 +112,18 @@ def test_chat_endpoint_with_file_context(mock_get_models, mock_fetch_url, mock_p
 @patch('routes.main_routes.save_chat_history')
 # Removed: @patch('routes.main_routes.generate_response_stream')
 @patch('routes.main_routes.process_context_path')
-@patch('routes.main_routes.fetch_and_process_url')
-@patch('routes.main_routes.get_available_models')
-def test_chat_endpoint_context_error_handling(mock_get_models, mock_fetch_url, mock_process_path, mock_save_history, client, mock_gemini_client, monkeypatch): # Removed mock_gen_stream
+@patch('routes.main_routes.fetch_and_process_urls')
+@patch('routes.main_routes.is_model_available', return_value=True)
+def test_chat_endpoint_context_error_handling(mock_is_model_available, mock_fetch_url, mock_process_path, mock_save_history, client, mock_gemini_client, monkeypatch): # Removed mock_gen_stream
     # Ensure gemini_utils.client is the mock from the fixture
     monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client, raising=False) # This ensures the global client in gemini_utils is our mock
 
-    mock_get_models.return_value = [DEFAULT_MODEL_NAME]
     good_context_info = {"original": "good.txt", "status": "ok", "path_type": "file", "message": "Processed good.txt"}
     # Correct bad_context_info to reflect the actual input URL
     bad_context_info = {"original": "http://bad.url", "status": "error", "path_type": "url", "message": "URL fetch error"}
 
     mock_process_path.return_value = ("Good context. ", None, good_context_info)
-    mock_fetch_url.return_value = ("", "URL fetch error", bad_context_info) # error string in 2nd pos
+    mock_fetch_url.return_value = [("", "URL fetch error", bad_context_info)] # One result per URL, error string in 2nd pos
 
     # Configure the mock_gemini_client (which is gemini_utils.client.models)
     # to make its generate_content_stream method return the desired stream.
@@ -165,6 +162,7 @@ def test_chat_endpoint_context_error_handling(mock_get_models, mock_fetch_url, m
     # Current bad_context_info: {"original": "bad.url", ...}
     # Let's adjust bad_context_info for this test.
     # updated_bad_context_info = {"original": "http://bad.url", "status": "error", "path_type": "url", "message": "URL fetch error"} # No longer needed
+    mock_fetch_url.assert_called_once_with(["http://bad.url"]) # URLs are fetched as one batch
     expected_db_context_info = [good_context_info, bad_context_info] # Use the corrected bad_context_info
     mock_save_history.assert_called_once_with("Check this", "Response based on good context.", expected_db_context_info)
 
@@ -187,7 +185,8 @@ def test_chat_endpoint_no_message_no_context(client, mock_gemini_client, monkeyp
     assert "No message or context provided" in response.json['error']
 
 @patch('routes.main_routes.get_available_models', return_value=["other_model"])
-def test_chat_endpoint_invalid_model(mock_get_avail_models, client, mock_gemini_client, monkeypatch): # Added mock_gemini_client, monkeypatch
+@patch('routes.main_routes.is_model_available', return_value=False)
+def test_chat_endpoint_invalid_model(mock_is_model_available, mock_get_avail_models, client, mock_gemini_client, monkeypatch): # Added mock_gemini_client, monkeypatch
     # Ensure gemini_utils.client is the mock
     monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client, raising=False)
 
@@ -231,6 +230,14 @@ def test_fetch_history_by_date(mock_get_chat_history, client):
     assert response.json == {'history': mock_data}
     mock_get_chat_history.assert_called_once_with("2023-01-02")
 
+@patch('routes.main_routes.get_chat_history')
+def test_fetch_history_escapes_messages(mock_get_chat_history, client):
+    mock_get_chat_history.return_value = [{"user_message": "<b>hi</b>", "bot_response": "a & <script>", "timestamp": "2023-01-03 09:00:00"}]
+
+    response = client.get('/fetch_history')
+    assert response.status_code == 200
+    assert response.json == {'history': [{"user_message": "&lt;b&gt;hi&lt;/b&gt;", "bot_response": "a &amp; &lt;script&gt;", "timestamp": "2023-01-03 09:00:00"}]}
+
 
 # --- Tests for /delete_history/<date_str> ---
 @patch('routes.main_routes.delete_history_by_date')
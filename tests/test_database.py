@@ -1,7 +1,6 @@
 import pytest
 import sqlite3
 import json
-import html
 from datetime import datetime, timedelta
 
 # Assuming database.py functions might use current_app from Flask for config (e.g., DB_NAME)
@@ -11,10 +10,12 @@ from datetime import datetime, timedelta
 from database import (
     init_db, # Though called by app fixture, can be tested for idempotency or directly if needed
     save_chat_history,
+    save_chat_history_many,
     get_chat_history,
+    iter_chat_history,
     get_distinct_chat_dates,
     delete_history_by_date,
-    # get_db # Not explicitly tested, but used by other functions
+    get_db,
 )
 
 # Helper function to get a raw DB connection for assertions
@@ -47,6 +48,56 @@ def test_init_db(app):
         assert 'context_info' in columns
         assert columns['context_info'] == 'TEXT' # Stored as JSON string
 
+def test_init_db_enables_wal(app):
+    """init_db switches the database file to WAL journaling, which persists for later connections."""
+    with app.app_context():
+        conn = get_raw_db_connection(app)
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.close()
+        assert journal_mode == 'wal'
+
+def test_init_db_creates_timestamp_indexes(app):
+    """init_db indexes timestamp and the derived date_only column for the date-filtered queries."""
+    with app.app_context():
+        conn = get_raw_db_connection(app)
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(history)")}
+        conn.execute("INSERT INTO history (timestamp, user_message, bot_response) VALUES ('2024-02-29 23:59:59', 'u', 'b')")
+        date_only = conn.execute("SELECT date_only FROM history WHERE user_message = 'u'").fetchone()[0]
+        conn.close()
+        assert {'idx_history_ts', 'idx_history_date_only'} <= indexes
+        assert not {'idx_history_timestamp', 'idx_history_date'} & indexes # Same set as app.py's init_db
+        assert date_only == '2024-02-29'
+
+def test_init_db_adds_date_only_to_existing_table(app):
+    """Re-running init_db on a database created before date_only existed adds the column once."""
+    with app.app_context():
+        conn = get_raw_db_connection(app)
+        conn.execute("DROP TABLE history")
+        conn.execute("CREATE TABLE history (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, user_message TEXT NOT NULL, bot_response TEXT NOT NULL, context_info TEXT NULL)")
+        conn.commit()
+        conn.close()
+
+        init_db()
+        init_db() # Idempotent
+
+        conn = get_raw_db_connection(app)
+        columns = [row[1] for row in conn.execute("PRAGMA table_xinfo(history)")]
+        conn.close()
+        assert columns.count('date_only') == 1
+
+def test_get_db_reuses_connection_per_thread(app):
+    """get_db hands back the same connection within a thread and a separate one in another thread."""
+    import threading
+    with app.app_context():
+        conn = get_db()
+        assert get_db() is conn
+
+        other = []
+        worker = threading.Thread(target=lambda: other.append(get_db()))
+        worker.start()
+        worker.join()
+        assert other[0] is not None and other[0] is not conn
+
 def test_save_chat_history(app):
     """Test saving a chat interaction."""
     with app.app_context():
@@ -84,6 +135,25 @@ def test_save_chat_history(app):
         assert row_no_context[2] is None
 
 
+def test_save_chat_history_many(app):
+    """Test saving several interactions in one batch."""
+    with app.app_context():
+        context = [{"file": "a.txt", "status": "ok"}]
+        rows = [("Batch one", "Reply one", context), ("Batch two", "Reply two", None)]
+
+        assert save_chat_history_many(rows) == True
+        assert save_chat_history_many([]) == True
+
+        conn = get_raw_db_connection(app)
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_message, bot_response, context_info FROM history WHERE user_message LIKE 'Batch %' ORDER BY id")
+        saved = cursor.fetchall()
+        conn.close()
+
+        assert [(r[0], r[1]) for r in saved] == [("Batch one", "Reply one"), ("Batch two", "Reply two")]
+        assert json.loads(saved[0][2]) == context
+        assert saved[1][2] is None
+
 def test_get_chat_history(app):
     """Test fetching chat history with various scenarios."""
     with app.app_context():
@@ -113,14 +183,14 @@ def test_get_chat_history(app):
         assert len(all_history) == 3
         assert all_history[0]['user_message'] == "Yesterday msg" # Check order (ASC by timestamp)
         assert all_history[1]['user_message'] == "Today msg 1"
-        assert all_history[2]['user_message'] == html.escape("Today msg 2 <tag>")
-        assert all_history[2]['bot_response'] == html.escape("Bot today 2 &")
+        assert all_history[2]['user_message'] == "Today msg 2 <tag>" # Returned unescaped; escaping happens at render
+        assert all_history[2]['bot_response'] == "Bot today 2 &"
 
         # 2. Fetch history for today
         today_history = get_chat_history(selected_date=today_str)
         assert len(today_history) == 2
         assert today_history[0]['user_message'] == "Today msg 1"
-        assert today_history[1]['user_message'] == html.escape("Today msg 2 <tag>")
+        assert today_history[1]['user_message'] == "Today msg 2 <tag>"
 
         # 3. Fetch history for a date with no entries
         future_date_str = (now + timedelta(days=1)).strftime('%Y-%m-%d')
@@ -146,6 +216,21 @@ def test_get_chat_history(app):
         assert len(empty_history) == 0
 
 
+def test_iter_chat_history_streams_in_batches(app, monkeypatch):
+    """iter_chat_history yields every row in order across several fetchmany batches."""
+    import database
+    monkeypatch.setattr(database, 'HISTORY_FETCH_BATCH', 2)
+    with app.app_context():
+        conn = get_raw_db_connection(app)
+        conn.executemany("INSERT INTO history (timestamp, user_message, bot_response) VALUES (?, ?, ?)",
+                         [(f"2024-01-01 10:00:0{i}", f"msg {i}", f"res {i}") for i in range(5)])
+        conn.commit()
+        conn.close()
+
+        history = iter_chat_history("2024-01-01")
+        assert not isinstance(history, list)
+        assert [msg['user_message'] for msg in history] == [f"msg {i}" for i in range(5)]
+
 def test_get_distinct_chat_dates(app):
     """Test fetching distinct chat dates."""
     with app.app_context():
@@ -253,3 +338,19 @@ def test_delete_history_by_date(app):
         deleted_count_empty = delete_history_by_date(today_str) # Try deleting today again
         assert deleted_count_empty == 0
         conn.close() # Close connection at the end of test
+
+def test_delete_history_by_date_day_boundaries(app):
+    """Only rows from the first to the last second of the date are deleted."""
+    with app.app_context():
+        conn = get_raw_db_connection(app)
+        cursor = conn.cursor()
+        for ts in ("2024-01-01 23:59:59", "2024-01-02 00:00:00", "2024-01-02 23:59:59", "2024-01-03 00:00:00"):
+            cursor.execute("INSERT INTO history (timestamp, user_message, bot_response) VALUES (?, ?, ?)",
+                           (ts, f"msg {ts}", "bot"))
+        conn.commit()
+
+        assert delete_history_by_date("2024-01-02") == 2
+
+        remaining = [row[0] for row in cursor.execute("SELECT timestamp FROM history ORDER BY timestamp")]
+        assert remaining == ["2024-01-01 23:59:59", "2024-01-03 00:00:00"]
+        conn.close()
@@ -4,7 +4,7 @@ import shutil
 from unittest.mock import patch, MagicMock, ANY # Moved ANY here
 
 # Functions to test
-from context_processing import fetch_and_process_url, process_context_path
+from context_processing import fetch_and_process_url, fetch_and_process_urls, process_context_path, extract_html_text, is_within_dir
 
 # Config values that might be relevant
 from config import (
@@ -118,11 +118,76 @@ def test_fetch_url_content_exceeds_limit(mock_requests_get, monkeypatch):
     assert "12345" in context
     assert "67890" not in context # Ensure the rest is not there
     assert "... (Content Truncated)" in context # Check for the specific truncation message in context
+    # Reading stopped early, so the connection must be released explicitly
+    mock_requests_get.return_value.close.assert_called_once()
     assert "URL content exceeds limit" in info["message"]
     assert info["status"] == "ok" # Status is still 'ok' because some content was processed
     assert info["context_added"] is True
 
 
+def test_fetch_url_uses_declared_charset(mock_requests_get):
+    mock_requests_get.return_value.headers = {'content-type': 'text/plain; charset=ISO-8859-1'}
+    mock_requests_get.return_value.iter_content.return_value = iter(["Caf\u00e9 cr\u00e8me".encode('iso-8859-1')])
+
+    context, error, info = fetch_and_process_url("http://example.com/latin1")
+
+    assert error is None
+    assert "Caf\u00e9 cr\u00e8me" in context
+
+def test_fetch_url_undeclared_non_utf8_is_detected(mock_requests_get):
+    mock_requests_get.return_value.headers = {'content-type': 'text/plain'}
+    text = "Les \u00e9l\u00e8ves ont r\u00e9vis\u00e9 leurs le\u00e7ons pendant la soir\u00e9e d'\u00e9t\u00e9. " * 5
+    mock_requests_get.return_value.iter_content.return_value = iter([text.encode('cp1252')])
+
+    context, error, info = fetch_and_process_url("http://example.com/cp1252")
+
+    assert error is None
+    assert "r\u00e9vis\u00e9" in context
+
+def test_fetch_url_revalidates_cached_result_with_etag(mock_requests_get):
+    url = "http://example.com/etag"
+    mock_requests_get.return_value.headers = {'content-type': 'text/plain', 'etag': '"v1"'}
+    mock_requests_get.return_value.iter_content.return_value = iter([b"Cached body"])
+    first_context, _, _ = fetch_and_process_url(url)
+
+    not_modified = MagicMock(spec=requests.Response)
+    not_modified.status_code = 304
+    not_modified.headers = {'etag': '"v1"'}
+    mock_requests_get.return_value = not_modified
+    context, error, info = fetch_and_process_url(url)
+
+    assert mock_requests_get.call_args.kwargs['headers']['If-None-Match'] == '"v1"'
+    not_modified.iter_content.assert_not_called()
+    assert error is None
+    assert context == first_context
+    assert "Cached body" in context
+    assert info["status"] == "ok"
+
+def test_fetch_urls_runs_concurrently_and_keeps_order():
+    import threading
+    barrier = threading.Barrier(3, timeout=5) # Deadlocks (BrokenBarrierError) if fetches run one at a time
+
+    def fake_fetch(url):
+        barrier.wait()
+        return (f"Context for {url}", None, {"original": url})
+
+    urls = ["http://a.example", "http://b.example", "http://c.example"]
+    with patch('context_processing.fetch_and_process_url', side_effect=fake_fetch):
+        results = fetch_and_process_urls(urls)
+
+    assert [info["original"] for _, _, info in results] == urls
+    assert fetch_and_process_urls([]) == []
+
+def test_extract_html_text_drops_scripts_keeps_following_text():
+    html_doc = "<html><body><p>Before</p><script>var x = 1;</script>After <b>bold</b><style>p {}</style></body></html>"
+    assert extract_html_text(html_doc) == "Before After bold"
+
+def test_extract_html_text_falls_back_for_unparseable_input():
+    # lxml rejects str input carrying an XML encoding declaration; BeautifulSoup handles it
+    html_doc = '<?xml version="1.0" encoding="utf-8"?><html><body><p>Still read</p></body></html>'
+    assert "Still read" in extract_html_text(html_doc)
+
+
 # --- Tests for process_context_path ---
 
 @pytest.fixture(autouse=True)
@@ -151,6 +216,17 @@ def test_process_path_read_file_success(temp_allowed_context_dir, monkeypatch):
     assert info["original"] == "testfile.txt"
     assert info["resolved"] == file_path_abs
 
+def test_process_path_read_file_normalizes_newlines_and_skips_bad_bytes(temp_allowed_context_dir, monkeypatch):
+    monkeypatch.setattr(config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
+    with open(os.path.join(temp_allowed_context_dir, "crlf.txt"), "wb") as f:
+        f.write(b"line one\r\nline\xff two\r\n")
+
+    context, error, info = process_context_path("crlf.txt")
+
+    assert error is None
+    assert "line one\nline two\n" in context
+    assert "\r" not in context
+
 def test_process_path_file_too_large(temp_allowed_context_dir, monkeypatch):
     monkeypatch.setattr(config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
     monkeypatch.setattr(config, 'MAX_FILE_READ_BYTES', 5)
@@ -210,6 +286,19 @@ def test_process_path_list_directory_success(temp_allowed_context_dir, monkeypat
     assert "file2.txt [File]" in context_sub
     assert info_sub["status"] == "ok"
 
+def test_process_path_list_directory_skips_symlink_outside(temp_allowed_context_dir, monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
+    outside_file = tmp_path / "secret.txt"
+    outside_file.write_text("secret")
+    os.symlink(outside_file, os.path.join(temp_allowed_context_dir, "link.txt"))
+    with open(os.path.join(temp_allowed_context_dir, "plain.txt"), "w") as f: f.write("ok")
+
+    context, error, info = process_context_path(".")
+
+    assert error is None
+    assert "plain.txt [File]" in context
+    assert "SKIPPING ITEM (outside allowed dir): ./link.txt" in context
+
 def test_process_path_list_empty_directory(temp_allowed_context_dir, monkeypatch):
     monkeypatch.setattr(config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
     empty_dir_name = "empty_dir"
@@ -238,6 +327,14 @@ def test_process_path_security_path_traversal(temp_allowed_context_dir, monkeypa
     assert "Path traversal ('..')" in info["message"] or "is outside the allowed directory" in info["message"]
     assert info["status"] == "error"
 
+def test_is_within_dir_compares_whole_components():
+    base = os.path.join(os.sep, "srv", "allowed")
+    assert is_within_dir(base, base)
+    assert is_within_dir(os.path.join(base, "sub", "file.txt"), base)
+    assert not is_within_dir(base + "-other", base) # Shares the string prefix only
+    assert not is_within_dir(os.path.join(os.sep, "srv"), base)
+    assert not is_within_dir("relative/path", base)
+
 def test_process_path_with_quotes_and_spaces(temp_allowed_context_dir, monkeypatch):
     monkeypatch.setattr(config, 'ALLOWED_CONTEXT_DIR', temp_allowed_context_dir)
     file_content = "File with spaces in name"
@@ -7,6 +7,7 @@ import json # For generate_response_stream tests
 from gemini_utils import (
     configure_client, # Renamed from configure_gemini_api
     get_available_models,
+    is_model_available,
     generate_response_stream,
     generate_summary,
     FETCHED_MODELS_CACHE, # To inspect/clear cache
@@ -196,6 +197,52 @@ def test_get_available_models_default_model_added(mock_gemini_client, monkeypatc
     assert other_model_name in models
     assert sorted(models) == sorted([GEMINI_UTILS_DEFAULT_MODEL_NAME, other_model_name])
 
+def test_is_model_available(mock_gemini_client, monkeypatch):
+    monkeypatch.setattr(gemini_utils, 'GOOGLE_API_KEY', "fake_key")
+    monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
+
+    assert is_model_available(GEMINI_UTILS_DEFAULT_MODEL_NAME)
+    assert is_model_available('gemini-1.0-pro')
+    assert not is_model_available('gemini-unknown')
+    mock_gemini_client.models.list.assert_called_once() # Later checks use the cached list
+
+    # A refreshed list rebuilds the set
+    new_model = MagicMock(supported_actions=['generateContent'])
+    new_model.name = "models/gemini-new-model"
+    mock_gemini_client.models.list.return_value = [new_model]
+    assert is_model_available('gemini-new-model', force_refresh=True)
+    assert not is_model_available('gemini-1.0-pro')
+
+def test_get_available_models_serves_stale_list_and_refreshes(mock_gemini_client, monkeypatch, capsys):
+    monkeypatch.setattr(gemini_utils, 'GOOGLE_API_KEY', "fake_key")
+    monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
+    stale_list = ["gemini-stale"]
+    monkeypatch.setattr(gemini_utils, 'FETCHED_MODELS_CACHE', stale_list)
+    monkeypatch.setattr(gemini_utils, 'FETCHED_MODELS_AT', gemini_utils.time.time() - gemini_utils.MODELS_CACHE_TTL - 1)
+
+    with patch('gemini_utils.threading.Thread') as mock_thread:
+        assert get_available_models() is stale_list # Answered immediately from the stale cache
+    mock_thread.assert_called_once()
+    assert "refreshing in background" in capsys.readouterr().out
+
+    mock_thread.call_args.kwargs['target']() # Run the refresh inline
+    assert sorted(gemini_utils.FETCHED_MODELS_CACHE) == sorted([GEMINI_UTILS_DEFAULT_MODEL_NAME, 'gemini-1.0-pro'])
+    assert not gemini_utils._MODELS_REFRESH_LOCK.locked()
+
+def test_get_available_models_persists_to_cache_file(mock_gemini_client, monkeypatch, tmp_path):
+    cache_file = tmp_path / "models.json"
+    monkeypatch.setattr(gemini_utils, 'MODELS_CACHE_FILE', str(cache_file))
+    monkeypatch.setattr(gemini_utils, 'GOOGLE_API_KEY', "fake_key")
+    monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
+
+    fetched = get_available_models()
+    assert json.loads(cache_file.read_text())["models"] == fetched
+
+    # A fresh process (empty in-memory cache) starts from the file without calling the API
+    monkeypatch.setattr(gemini_utils, 'FETCHED_MODELS_CACHE', [])
+    assert get_available_models() == fetched
+    mock_gemini_client.models.list.assert_called_once()
+
 
 # --- Tests for generate_response_stream ---
 
@@ -211,11 +258,31 @@ def test_generate_response_stream_success(mock_gemini_client, monkeypatch):
 
     mock_gemini_client.models.generate_content_stream.assert_called_once_with(model=model_name, contents=prompt)
 
+    # The second chunk arrives right after the first, so it's held and flushed before end_stream
     assert len(stream_data) == 3 # 2 chunks + 1 end_stream
     assert json.loads(stream_data[0].split("data: ")[1]) == {"text": "Test response chunk 1."}
     assert json.loads(stream_data[1].split("data: ")[1]) == {"text": "Test response chunk 2."}
     assert json.loads(stream_data[2].split("data: ")[1]) == {"end_stream": True}
 
+def test_generate_response_stream_coalesces_small_chunks(mock_gemini_client, monkeypatch):
+    monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
+    monkeypatch.setattr(gemini_utils, 'SSE_COALESCE_MAX_CHARS', 10)
+    monkeypatch.setattr(gemini_utils, 'SSE_COALESCE_INTERVAL', 60) # Only the size threshold flushes
+    words = ["The", " quick", " brown", " fox", " jumps", "!"]
+    mock_gemini_client.models.generate_content_stream.return_value = iter([MagicMock(text=w) for w in words])
+
+    stream_data = list(generate_response_stream("prompt", GEMINI_UTILS_DEFAULT_MODEL_NAME))
+    events = [json.loads(d.split("data: ")[1]) for d in stream_data]
+
+    # First chunk goes out at once, then text is batched until it reaches 10 chars, remainder flushed at the end
+    assert events == [
+        {"text": "The"},
+        {"text": " quick brown"},
+        {"text": " fox jumps"},
+        {"text": "!"},
+        {"end_stream": True},
+    ]
+
 def test_generate_response_stream_api_error(mock_gemini_client, monkeypatch):
     monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
     mock_gemini_client.models.generate_content_stream.side_effect = Exception("API Error")
@@ -240,6 +307,28 @@ def test_generate_response_stream_no_text_in_chunk(mock_gemini_client, monkeypat
     assert json.loads(stream_data[1].split("data: ")[1]) == {"end_stream": True}
 
 
+def test_generate_response_stream_flushes_buffered_text_during_a_pause(mock_gemini_client, monkeypatch):
+    import threading
+    monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
+    monkeypatch.setattr(gemini_utils, 'SSE_COALESCE_INTERVAL', 0.05)
+    resume = threading.Event()
+
+    def pausing_stream():
+        yield MagicMock(text="Hello")
+        yield MagicMock(text=" world") # Arrives right after "Hello", so it's buffered
+        assert resume.wait(timeout=5) # Model pauses until the test has seen " world"
+        yield MagicMock(text="!")
+    mock_gemini_client.models.generate_content_stream.return_value = pausing_stream()
+
+    stream = generate_response_stream("prompt", GEMINI_UTILS_DEFAULT_MODEL_NAME)
+    assert json.loads(next(stream).split("data: ")[1]) == {"text": "Hello"}
+    # Sent once the interval passes, without waiting for the next chunk
+    assert json.loads(next(stream).split("data: ")[1]) == {"text": " world"}
+    resume.set()
+    rest = [json.loads(d.split("data: ")[1]) for d in stream]
+    assert rest == [{"text": "!"}, {"end_stream": True}]
+
+
 # --- Tests for generate_summary ---
 
 def test_generate_summary_success(mock_gemini_client, monkeypatch):
@@ -276,7 +365,7 @@ def test_get_available_models_prints_sdk_error(mock_gemini_client, monkeypatch,
     monkeypatch.setattr(gemini_utils, 'client', mock_gemini_client)
     mock_gemini_client.models.list.side_effect = Exception("Custom SDK Error")
     # Fallback also fails
-    with patch('gemini_utils.requests.get', side_effect=requests.exceptions.RequestException("HTTP Error")):
+    with patch('gemini_utils.HTTP_SESSION.get', side_effect=requests.exceptions.RequestException("HTTP Error")):
         get_available_models()
 
     captured = capsys.readouterr()
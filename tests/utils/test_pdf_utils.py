@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import MagicMock, patch
 from io import BytesIO
+import pikepdf
 
 # Function to test
 from pdf_utils import convert_images_to_pdf, PDFConversionError
@@ -12,8 +13,20 @@ from config import ALLOWED_PDF_EXTENSIONS
 from pytesseract import TesseractNotFoundError as PytesseractOriginalNotFoundError
 
 
+# Helper to build a real one-page PDF, like tesseract returns per image; width tells pages apart
+def make_page_pdf(width):
+    pdf = pikepdf.Pdf.new()
+    pdf.add_blank_page(page_size=(width, 100))
+    out = BytesIO()
+    pdf.save(out)
+    return out.getvalue()
+
+def page_widths(pdf_bytes):
+    with pikepdf.Pdf.open(BytesIO(pdf_bytes)) as pdf:
+        return [float(page.mediabox[2]) for page in pdf.pages]
+
 # Helper to create a mock file object (like Flask's FileStorage)
-def create_mock_image_file(filename="test.jpg", content=b"fake_jpeg_bytes", read_error=None, verify_error=None, pil_format='JPEG', is_empty=False):
+def create_mock_image_file(filename="test.jpg", content=b"fake_jpeg_bytes", read_error=None, verify_error=None, pil_format='JPEG', is_empty=False, load_error=None):
     mock_file = MagicMock(spec=['filename', 'read', 'seek'])
     mock_file.filename = filename
 
@@ -24,8 +37,10 @@ def create_mock_image_file(filename="test.jpg", content=b"fake_jpeg_bytes", read
     else:
         mock_file.read.return_value = content
 
-    mock_image_instance = MagicMock(spec=['verify', 'format', 'close']) # Added 'close'
+    mock_image_instance = MagicMock(spec=['verify', 'load', 'format', 'close']) # Added 'close'
     mock_image_instance.format = pil_format
+    if load_error:
+        mock_image_instance.load.side_effect = load_error
 
     if verify_error:
         mock_image_instance.verify.side_effect = verify_error
@@ -60,32 +75,41 @@ def test_convert_images_no_ocr_success(MockPILImage, mock_img2pdf_convert): # mo
 
 
 @patch('pdf_utils.Image')
-@patch('pdf_utils.PdfMerger')
-def test_convert_images_with_ocr_success(MockPdfMerger, MockPILImage, mock_pytesseract): # mock_pytesseract from conftest
+def test_convert_images_with_ocr_success(MockPILImage, mock_pytesseract): # mock_pytesseract from conftest
     mock_file1, mock_img_instance1 = create_mock_image_file("img1.jpg")
-    # For OCR, Image.open is called for initial validation, then again for processing.
-    MockPILImage.open.side_effect = [mock_img_instance1, mock_img_instance1]
+    # For OCR, the image opened for validation is loaded and reused for processing.
+    MockPILImage.open.side_effect = [mock_img_instance1]
 
-    ocr_page_bytes = b"searchable_pdf_bytes_from_ocr"
-    mock_pytesseract.return_value = ocr_page_bytes # Fixture provides the mock
-
-    mock_merger_instance = MockPdfMerger.return_value
-    # Simulate PdfMerger.write writing the OCR'd page bytes to the stream
-    def mock_merger_write_effect(output_stream):
-        output_stream.write(ocr_page_bytes)
-    mock_merger_instance.write.side_effect = mock_merger_write_effect
+    mock_pytesseract.return_value = make_page_pdf(200) # Fixture provides the mock
 
     files = [mock_file1]
     pdf_stream = convert_images_to_pdf(files, ocr_enabled=True)
 
-    assert pdf_stream.getvalue() == ocr_page_bytes
-    # PIL.Image.open called for validation, then for pytesseract
-    assert MockPILImage.open.call_count == 2
-    mock_img_instance1.verify.assert_called_once()
+    assert page_widths(pdf_stream.getvalue()) == [200] # The OCR'd page, merged by pikepdf
+    # PIL.Image.open called once; the loaded image goes to pytesseract
+    assert MockPILImage.open.call_count == 1
+    mock_img_instance1.load.assert_called_once()
+    mock_img_instance1.verify.assert_not_called() # verify() would invalidate the image
     mock_pytesseract.assert_called_once_with(mock_img_instance1, extension='pdf')
-    mock_merger_instance.append.assert_called_once()
-    mock_merger_instance.write.assert_called_once()
-    mock_merger_instance.close.assert_called_once()
+
+
+@patch('pdf_utils.Image')
+def test_convert_images_with_ocr_runs_pages_in_parallel(MockPILImage, mock_pytesseract, monkeypatch):
+    import threading
+    monkeypatch.setattr('pdf_utils.os.cpu_count', lambda: 2)
+    mock_file1, mock_img_instance1 = create_mock_image_file("img1.jpg")
+    mock_file2, mock_img_instance2 = create_mock_image_file("img2.jpg")
+    MockPILImage.open.side_effect = [mock_img_instance1, mock_img_instance2]
+
+    barrier = threading.Barrier(2, timeout=5) # Breaks (BrokenBarrierError) if pages are OCR'd one at a time
+    def fake_ocr(img, extension):
+        barrier.wait()
+        return make_page_pdf(100) if img is mock_img_instance1 else make_page_pdf(200)
+    mock_pytesseract.side_effect = fake_ocr
+
+    pdf_stream = convert_images_to_pdf([mock_file1, mock_file2], ocr_enabled=True)
+
+    assert page_widths(pdf_stream.getvalue()) == [100, 200] # Merged in the original page order
 
 
 def test_convert_no_files_provided():
@@ -106,6 +130,13 @@ def test_convert_image_pil_verify_error(MockPILImage):
     with pytest.raises(PDFConversionError, match="Invalid or corrupted image file: bad.jpg"):
         convert_images_to_pdf([mock_file])
 
+@patch('pdf_utils.Image')
+def test_convert_image_pil_load_error_with_ocr(MockPILImage):
+    mock_file, mock_img_instance = create_mock_image_file("truncated.jpg", load_error=OSError("image file is truncated"))
+    MockPILImage.open.return_value = mock_img_instance
+    with pytest.raises(PDFConversionError, match="Invalid or corrupted image file: truncated.jpg"):
+        convert_images_to_pdf([mock_file], ocr_enabled=True)
+
 @patch('pdf_utils.Image')
 def test_convert_image_pil_format_error(MockPILImage):
     # Simulate PIL identifying a non-JPEG format after opening.
@@ -135,7 +166,7 @@ def test_convert_empty_file_content(MockPILImage):
 @patch('pdf_utils.Image')
 def test_convert_ocr_tesseract_not_found_error(MockPILImage, mock_pytesseract): # mock_pytesseract from conftest
     mock_file1, mock_img_instance1 = create_mock_image_file("img1.jpg")
-    MockPILImage.open.side_effect = [mock_img_instance1, mock_img_instance1]
+    MockPILImage.open.side_effect = [mock_img_instance1]
 
     # Configure the conftest fixture mock to raise the original Pytesseract error
     # Set side_effect to the class, not an instance, to avoid constructor issues.
@@ -145,10 +176,9 @@ def test_convert_ocr_tesseract_not_found_error(MockPILImage, mock_pytesseract):
         convert_images_to_pdf([mock_file1], ocr_enabled=True)
 
 @patch('pdf_utils.Image')
-@patch('pdf_utils.PdfMerger') # Mock PdfMerger as it's used in OCR path
-def test_convert_ocr_generic_pytesseract_error(MockPdfMerger, MockPILImage, mock_pytesseract):
+def test_convert_ocr_generic_pytesseract_error(MockPILImage, mock_pytesseract):
     mock_file1, mock_img_instance1 = create_mock_image_file("img1.jpg")
-    MockPILImage.open.side_effect = [mock_img_instance1, mock_img_instance1]
+    MockPILImage.open.side_effect = [mock_img_instance1]
     mock_pytesseract.side_effect = Exception("Some other OCR lib error")
 
     with pytest.raises(PDFConversionError, match="An error occurred during OCR processing"):
@@ -179,9 +209,9 @@ def test_convert_no_valid_files_after_validation(monkeypatch):
         convert_images_to_pdf([mock_file1])
 
 @patch('pdf_utils.Image')
-def test_convert_ocr_pytesseract_returns_empty_data(MockPILImage, mock_pytesseract, MockPdfMerger):
+def test_convert_ocr_pytesseract_returns_empty_data(MockPILImage, mock_pytesseract):
     mock_file1, mock_img_instance1 = create_mock_image_file("img.jpg")
-    MockPILImage.open.side_effect = [mock_img_instance1, mock_img_instance1]
+    MockPILImage.open.side_effect = [mock_img_instance1]
 
     mock_pytesseract.return_value = b"" # Simulate pytesseract returning empty bytes
 